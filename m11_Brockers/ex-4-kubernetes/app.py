@@ -1,8 +1,11 @@
 from fastapi import FastAPI
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
+from typing import List
 import os
 
+from fast_response import FastJSONResponse
+
 app = FastAPI()
 
 messages = []
@@ -15,9 +18,10 @@ class Message(BaseModel):
 def index():
     return FileResponse('index.html')
 
-@app.get("/messages")
+@app.get("/messages", response_model=List[Message])
 def get_messages():
-    return messages
+    # Сообщения уже проверены при добавлении - отдаем без повторной обработки
+    return FastJSONResponse(messages)
 
 @app.post("/messages")
 def add_message(message: Message):
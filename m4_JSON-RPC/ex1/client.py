@@ -1,23 +1,23 @@
 import asyncio
-from jsonrpcclient import Ok, parse_json, request_json
+from rpc_client import RPCClient, RPCError
 
-async def main():
-    # Пример запроса к методу `add`
-    add_request = request_json("add", params=[2, 3])
-    print("Запрос (add):", add_request)
+API_URL = "http://localhost:5000/rpc"
 
-    # Пример запроса к методу `get_user`
-    user_request = request_json("get_user", params=[2])
-    print("Запрос (get_user):", user_request)
+async def main():
+    # Один клиент на все вызовы: соединение с сервером переиспользуется
+    async with RPCClient(API_URL) as rpc:
+        # Обычные вызовы - по одному HTTP-запросу
+        print("Результат (add):", await rpc.call("add", [2, 3]))  # 5
+        print("Результат (get_user):", await rpc.call("get_user", [2]))  # {'id': 2, 'name': 'Bob'}
 
-    # Отправляем запросы на сервер (можно через `aiohttp`, `requests` и т.д.)
-    # Здесь просто парсим ответ вручную для демонстрации
-    add_response = parse_json('{"jsonrpc": "2.0", "result": 5, "id": 1}')
-    if isinstance(add_response, Ok):
-        print("Результат (add):", add_response.result)  # 5
+        # Вызовы, сделанные одновременно, уходят одним пакетом (JSON-массивом)
+        users = await asyncio.gather(*(rpc.call("get_user", [user_id]) for user_id in (1, 2, 3)))
+        print("Пакет (get_user x3):", users)
 
-    user_response = parse_json('{"jsonrpc": "2.0", "result": {"id": 2, "name": "Bob"}, "id": 2}')
-    if isinstance(user_response, Ok):
-        print("Результат (get_user):", user_response.result)  # {'id': 2, 'name': 'Bob'}
+        # Ошибка JSON-RPC (здесь - нет такого метода) - исключение RPCError
+        try:
+            await rpc.call("multiply", [2, 3])
+        except RPCError as e:
+            print("Ошибка (multiply):", e)
 
 asyncio.run(main())
@@ -1,21 +1,24 @@
 from aiohttp import web
-from jsonrpcserver import method, async_dispatch
+from jsonrpcserver import method, async_dispatch, Success
 
 # Регистрируем методы API
 @method
 async def add(a, b):
-    return {"result": a + b}
+    return Success(a + b)
 
 @method
 async def get_user(user_id):
     users = {1: "Alice", 2: "Bob", 3: "Charlie"}
-    return {"id": user_id, "name": users.get(user_id, "Unknown")}
+    return Success({"id": user_id, "name": users.get(user_id, "Unknown")})
 
 # Обработчик JSON-RPC запросов
 async def handle_rpc(request):
     request_data = await request.text()
     response = await async_dispatch(request_data)
-    return web.json_response(response)
+    if not response:
+        return web.Response(status=204)  # только уведомления - ответ не нужен
+    # async_dispatch уже вернул JSON-текст - отдаем как есть
+    return web.Response(text=response, content_type="application/json")
 
 app = web.Application()
 app.router.add_post("/rpc", handle_rpc)
@@ -12,11 +12,17 @@ async def get_user(user_id):
     users = {1: "Alice", 2: "Bob", 3: "Charlie"}
     return Success({"id": user_id, "name": users.get(user_id, "Unknown")})
 
+def rpc_response(response):
+    """async_dispatch уже вернул JSON-текст - отдаем как есть"""
+    if not response:
+        return web.Response(status=204)  # только уведомления - ответ не нужен
+    return web.Response(text=response, content_type="application/json")
+
 # Обработчик POST JSON-RPC запросов
 async def handle_post_rpc(request):
     request_data = await request.text()
     response = await async_dispatch(request_data)
-    return web.json_response(response)
+    return rpc_response(response)
 
 # Обработчик GET JSON-RPC запросов
 async def handle_get_rpc(request):
@@ -46,7 +52,7 @@ async def handle_get_rpc(request):
     
     # Выполняем запрос
     response = await async_dispatch(json.dumps(jsonrpc_request))
-    return web.json_response(response)
+    return rpc_response(response)
 
 app = web.Application()
 # Регистрируем обработчики для POST и GET запросов
@@ -0,0 +1,239 @@
+"""Панель управления опрашивает 20 устройств: отдельные запросы против пакета.
+Второй замер - вызовов в секунду у клиентов: requests без сессии, с сессией
+и RPCClient (keep-alive, последовательно и пакетами). Третий - сколько
+сообщений и байт получают 10 панелей за 20 изменений: опрос get_all_devices
+каждые 100 мс против уведомлений по WebSocket. Четвертый - синхронизация
+5000 устройств после 10 изменений: get_all_devices против get_devices_since.
+Пятый - реестр на 20000 устройств: одновременные команды разным устройствам
+и сценарии не ждут друг друга, сценарий "выключить все" - одним проходом.
+
+Сервер запускается в этом же процессе, задержка связи с устройством
+имитируется (SMART_HOME_LATENCY, по умолчанию здесь 20 мс; в замере
+клиентов - 0, чтобы измерялись сами вызовы).
+
+Запуск: python bench.py
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+
+os.environ.setdefault("SMART_HOME_LATENCY", "0.02")
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+import requests
+
+from rpc_client import RPCClient
+import smart_home_api
+
+DEVICES = 20
+
+def status_call(device_id, call_id):
+    return {"jsonrpc": "2.0", "method": "get_device_status", "params": {"device_id": device_id}, "id": call_id}
+
+async def one_by_one(client, device_ids):
+    for i, device_id in enumerate(device_ids):
+        response = await client.post("/api", json=status_call(device_id, i))
+        assert "result" in await response.json()
+
+async def batch(client, device_ids):
+    response = await client.post("/api", json=[status_call(device_id, i) for i, device_id in enumerate(device_ids)])
+    assert len(await response.json()) == len(device_ids)
+
+async def measure(scenario, client, device_ids, rounds=5):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await scenario(client, device_ids)
+    return (time.perf_counter() - start) / rounds * 1000
+
+async def bench_dashboard():
+    device_ids = [f"light_{i}" for i in range(DEVICES)]
+    for device_id in device_ids:
+        smart_home_api.registry.add(device_id, status="off", brightness=0, type="light")
+
+    print(f"{DEVICES} устройств, задержка устройства {smart_home_api.DEVICE_LATENCY * 1000:.0f} мс")
+    for name, scenario, limit in (
+        ("отдельные запросы", one_by_one, 0),
+        ("пакет, по одному вызову", batch, 1),
+        ("пакет, не больше 5 сразу", batch, 5),
+        ("пакет, параллельно", batch, 0),
+    ):
+        smart_home_api.BATCH_CONCURRENCY = limit
+        async with TestClient(TestServer(smart_home_api.create_app())) as client:
+            elapsed = await measure(scenario, client, device_ids)
+        print(f"{name:<28}{elapsed:>8.1f} мс")
+
+CALLS = 500
+
+def start_server():
+    """Сервер на свободном порту в фоновом потоке - для синхронного requests"""
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(smart_home_api.create_app())
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    port = runner.addresses[0][1]
+    return f"http://127.0.0.1:{port}/api"
+
+def requests_no_session(url):
+    for i in range(CALLS):
+        assert "result" in requests.post(url, json=status_call("tv", i)).json()
+
+def requests_session(url):
+    with requests.Session() as session:
+        for i in range(CALLS):
+            assert "result" in session.post(url, json=status_call("tv", i)).json()
+
+async def rpc_client_sequential(url):
+    async with RPCClient(url) as rpc:
+        for _ in range(CALLS):
+            await rpc.call("get_device_status", {"device_id": "tv"})
+
+async def rpc_client_gather(url):
+    async with RPCClient(url) as rpc:
+        await asyncio.gather(*(rpc.call("get_device_status", {"device_id": "tv"}) for _ in range(CALLS)))
+
+def bench_clients():
+    smart_home_api.DEVICE_LATENCY = 0
+    smart_home_api.BATCH_CONCURRENCY = 0
+    url = start_server()
+    print(f"\n{CALLS} вызовов get_device_status, задержка устройства 0 мс")
+    for name, scenario in (
+        ("requests, без сессии", requests_no_session),
+        ("requests.Session", requests_session),
+        ("RPCClient, по одному", lambda url: asyncio.run(rpc_client_sequential(url))),
+        ("RPCClient, gather (пакеты)", lambda url: asyncio.run(rpc_client_gather(url))),
+    ):
+        start = time.perf_counter()
+        scenario(url)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<28}{CALLS / elapsed:>8.0f} вызовов/с")
+
+async def bench_push(panels=10, changes=20, period=0.05, poll_interval=0.1):
+    smart_home_api.DEVICE_LATENCY = 0
+    lights = [f"light_{i}" for i in range(DEVICES)]
+    for device_id in lights:
+        if device_id not in smart_home_api.registry:
+            smart_home_api.registry.add(device_id, status="off", brightness=0, type="light")
+
+    async def change_devices(client, round_no):
+        for i in range(changes):
+            brightness = round_no * changes + i + 1  # каждый раз новое значение
+            call = {"jsonrpc": "2.0", "method": "set_light_brightness",
+                    "params": {"device_id": lights[i % DEVICES], "brightness": brightness}, "id": i}
+            await client.post("/api", json=call)
+            await asyncio.sleep(period)
+
+    print(f"\n{panels} панелей, {changes} изменений за {changes * period:.1f} с")
+    async with TestClient(TestServer(smart_home_api.create_app())) as client:
+        received = {"messages": 0, "bytes": 0}
+        done = asyncio.Event()
+
+        async def poll():
+            while not done.is_set():
+                response = await client.post("/api", json={"jsonrpc": "2.0", "method": "get_all_devices", "id": 1})
+                body = await response.read()
+                received["messages"] += 1
+                received["bytes"] += len(body)
+                await asyncio.sleep(poll_interval)
+
+        pollers = [asyncio.create_task(poll()) for _ in range(panels)]
+        await change_devices(client, 0)
+        done.set()
+        await asyncio.gather(*pollers)
+        print(f"{'опрос каждые 100 мс':<28}{received['messages']:>6} ответов {received['bytes'] / 1024:>8.1f} КБ")
+
+        received = {"messages": 0, "bytes": 0}
+        sockets = [await client.ws_connect("/ws") for _ in range(panels)]
+        for ws in sockets:
+            await ws.send_json({"jsonrpc": "2.0", "method": "subscribe", "params": {"events": ["device_changed"]}, "id": 1})
+            await ws.receive()
+
+        async def listen(ws):
+            async for message in ws:
+                received["messages"] += 1
+                received["bytes"] += len(message.data)
+
+        listeners = [asyncio.create_task(listen(ws)) for ws in sockets]
+        await change_devices(client, 1)
+        await asyncio.sleep(0.1)
+        for ws in sockets:
+            await ws.close()
+        await asyncio.gather(*listeners)
+        print(f"{'уведомления WebSocket':<28}{received['messages']:>6} сообщений {received['bytes'] / 1024:>6.1f} КБ")
+
+async def bench_sync(devices=5000, changes=10, rounds=20):
+    smart_home_api.DEVICE_LATENCY = 0
+    for i in range(devices):
+        smart_home_api.registry.add(f"sensor_{i}", status="on", value=0, type="sensor")
+
+    print(f"\n{len(smart_home_api.registry)} устройств, {changes} изменений между синхронизациями")
+    values = itertools.count(1)  # каждое изменение - новое значение
+
+    async with TestClient(TestServer(smart_home_api.create_app())) as client:
+        async def fetch(method, params=None):
+            call = {"jsonrpc": "2.0", "method": method, "params": params or {}, "id": 1}
+            response = await client.post("/api", json=call)
+            return await response.read()
+
+        # Клиент уже синхронизирован: помнит текущие версию и epoch
+        version, epoch = smart_home_api.registry.version, smart_home_api.registry.epoch
+        for name, method, params in (
+            ("get_all_devices", "get_all_devices", None),
+            ("get_devices_since", "get_devices_since", {"version": version, "epoch": epoch}),
+        ):
+            elapsed, size = 0, 0
+            for round_no in range(rounds):
+                for i in range(changes):
+                    smart_home_api.registry.update(f"sensor_{round_no * changes + i}", value=next(values))
+                start = time.perf_counter()
+                body = await fetch(method, params)
+                elapsed += time.perf_counter() - start
+                size = len(body)
+                if params:
+                    params["version"] = json.loads(body)["result"]["version"]
+            print(f"{name:<28}{elapsed / rounds * 1000:>8.2f} мс {size / 1024:>8.1f} КБ")
+
+async def bench_registry(rooms=100, lamps=200):
+    registry = smart_home_api.registry
+    for room in range(rooms):
+        lamp_ids = [f"lamp_{room}_{i}" for i in range(lamps)]
+        for device_id in lamp_ids:
+            registry.add(device_id, status="off", brightness=0, type="lamp")
+        registry.define_scene(f"room_{room}", devices={device_id: {"status": "on", "brightness": 50} for device_id in lamp_ids})
+    registry.define_scene("lamps_off", types={"lamp": {"status": "off", "brightness": 0}})
+    print(f"\n{len(registry)} устройств, задержка устройства 20 мс")
+
+    async with TestClient(TestServer(smart_home_api.create_app())) as client:
+        async def call(method, params):
+            response = await client.post("/api", json={"jsonrpc": "2.0", "method": method, "params": params, "id": 1})
+            assert "error" not in (await response.json())["result"]
+
+        async def timed(name, calls):
+            start = time.perf_counter()
+            await asyncio.gather(*calls)
+            print(f"{name:<44}{(time.perf_counter() - start) * 1000:>8.1f} мс")
+
+        smart_home_api.DEVICE_LATENCY = 0.02
+        # Последовательно это 70 задержек устройства (1.4 с)
+        await timed("60 команд разным устройствам + 10 сценариев", [
+            *(call("set_light_brightness", {"device_id": f"light_{i}", "brightness": 60 + i}) for i in range(DEVICES)),
+            *(call("set_device_status", {"device_id": f"lamp_{50 + i}_0", "status": "on"}) for i in range(40)),
+            *(call("activate_scene", {"scene_id": f"room_{i}"}) for i in range(10)),
+        ])
+        await timed("10 команд одному устройству", [
+            call("set_light_brightness", {"device_id": "light_0", "brightness": i + 1}) for i in range(10)
+        ])
+        smart_home_api.DEVICE_LATENCY = 0
+        await timed(f"сценарий lamps_off ({rooms * lamps} устройств)", [call("activate_scene", {"scene_id": "lamps_off"})])
+
+if __name__ == "__main__":
+    asyncio.run(bench_dashboard())
+    bench_clients()
+    asyncio.run(bench_push())
+    asyncio.run(bench_sync())
+    asyncio.run(bench_registry())
@@ -0,0 +1,145 @@
+"""Реестр устройств умного дома: состояние, индексы, блокировки, версии, сценарии.
+
+- Индексы по типу и по участию в сценариях: "все светильники" или
+  "устройства сценария" находятся без перебора всех устройств.
+- У каждого устройства своя asyncio.Lock: операции с одним устройством идут
+  по очереди, с разными - одновременно. Несколько устройств блокируются
+  в порядке id, поэтому взаимных блокировок нет.
+- Сценарий - данные: поля для конкретных устройств и/или для всех устройств
+  типа. Новое устройство подходящего типа сразу попадает в сценарий.
+- Версии изменений для синхронизации (changed_since): устройства хранятся
+  в порядке последнего изменения. Счетчик версий живет в памяти процесса,
+  поэтому вместе с версией клиент хранит epoch - id запуска реестра.
+"""
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from uuid import uuid4
+
+class DeviceRegistry:
+    def __init__(self, on_change=None):
+        self.devices = {}        # device_id -> состояние (dict)
+        self.locks = {}          # device_id -> asyncio.Lock
+        self.by_type = {}        # тип -> {device_id: None} (упорядоченное множество)
+        self.scenes = {}         # scene_id -> {"devices": {...}, "types": {...}, "actions": [...]}
+        self.scene_members = {}  # scene_id -> {device_id: поля, которые сценарий устанавливает}
+        self.version = 0
+        # id запуска: версии из другого запуска (до перезапуска сервера)
+        # с текущими не сравнимы, даже если меньше self.version
+        self.epoch = uuid4().hex
+        self.versions = OrderedDict()  # device_id -> версия последнего изменения
+        # on_change(device_id, тип, изменения, версия) - например, уведомление подписчиков
+        self.on_change = on_change
+
+    def __contains__(self, device_id):
+        return device_id in self.devices
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __iter__(self):
+        return iter(self.devices)
+
+    def get(self, device_id):
+        """Состояние устройства (не копия) или None"""
+        return self.devices.get(device_id)
+
+    def of_type(self, device_type):
+        return list(self.by_type.get(device_type, ()))
+
+    def snapshot(self, device_ids=None):
+        """Копии состояний: ответ не меняется вместе с устройствами"""
+        ids = self.devices if device_ids is None else device_ids
+        return {device_id: dict(self.devices[device_id]) for device_id in ids}
+
+    def bump_version(self, device_id):
+        self.version += 1
+        self.versions[device_id] = self.version
+        self.versions.move_to_end(device_id)
+        return self.version
+
+    def add(self, device_id, **state):
+        """Добавить устройство (или заменить его состояние целиком)"""
+        previous = self.devices.get(device_id)
+        if previous is not None:
+            self.by_type[previous["type"]].pop(device_id, None)
+            for members in self.scene_members.values():
+                members.pop(device_id, None)
+        self.devices[device_id] = state
+        self.locks.setdefault(device_id, asyncio.Lock())
+        self.by_type.setdefault(state["type"], {})[device_id] = None
+        for scene_id, scene in self.scenes.items():
+            fields = self.scene_fields(scene, device_id, state["type"])
+            if fields:
+                self.scene_members[scene_id][device_id] = fields
+        self.bump_version(device_id)
+
+    def update(self, device_id, **fields):
+        """Изменить поля устройства; возвращает только реально изменившиеся"""
+        device = self.devices[device_id]
+        changes = {name: value for name, value in fields.items() if device.get(name) != value}
+        if changes:
+            device.update(changes)
+            version = self.bump_version(device_id)
+            if self.on_change is not None:
+                self.on_change(device_id, device["type"], changes, version)
+        return changes
+
+    @asynccontextmanager
+    async def locked(self, device_ids):
+        """Заблокировать устройства на время операции (в порядке id)"""
+        locks = [self.locks[device_id] for device_id in sorted(device_ids)]
+        acquired = []
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def scene_fields(self, scene, device_id, device_type):
+        """Поля, которые сценарий устанавливает устройству; поля для
+        конкретного устройства дополняют и переопределяют поля для его типа"""
+        return {**scene["types"].get(device_type, {}), **scene["devices"].get(device_id, {})}
+
+    def define_scene(self, scene_id, devices=None, types=None, actions=()):
+        """Сценарий: devices - {device_id: поля}, types - {тип: поля для всех устройств типа}"""
+        scene = {"devices": devices or {}, "types": types or {}, "actions": list(actions)}
+        self.scenes[scene_id] = scene
+        candidates = [device_id for device_id in scene["devices"] if device_id in self.devices]
+        for device_type in scene["types"]:
+            candidates.extend(self.by_type.get(device_type, ()))
+        self.scene_members[scene_id] = {
+            device_id: self.scene_fields(scene, device_id, self.devices[device_id]["type"])
+            for device_id in candidates
+        }
+
+    def apply_scene(self, scene_id):
+        """Применить сценарий ко всем его устройствам; {device_id: изменения}
+        только для изменившихся. Устройства сценария должны быть заблокированы"""
+        changed = {}
+        for device_id, fields in self.scene_members[scene_id].items():
+            changes = self.update(device_id, **fields)
+            if changes:
+                changed[device_id] = changes
+        return changed
+
+    def changed_since(self, version, limit=0, epoch=None):
+        """(id устройств, измененных после version, от старых к новым; новая
+        версия; есть ли еще). Время - по числу изменений, а не устройств.
+        version из другого запуска (epoch не совпадает) - отдаются все"""
+        if epoch != self.epoch or version > self.version:
+            version = 0
+        changed = []
+        for device_id in reversed(self.versions):
+            if self.versions[device_id] <= version:
+                break
+            changed.append(device_id)
+        changed.reverse()
+        more = bool(limit) and len(changed) > limit
+        if more:
+            changed = changed[:limit]
+        high_water = self.versions[changed[-1]] if more else self.version
+        return changed, high_water, more
@@ -0,0 +1,113 @@
+"""Уведомления JSON-RPC по WebSocket: сервер сам сообщает клиентам об изменениях.
+
+Клиент подключается к /ws, вызывает там обычные методы API и метод
+subscribe с фильтром, после чего получает уведомления - запросы JSON-RPC
+без id:
+
+    {"jsonrpc": "2.0", "method": "device_changed",
+     "params": {"device_id": "tv", "type": "media", "changes": {"status": "on"}, "version": 7}}
+
+Уведомление отправляется только при реальном изменении значения и содержит
+только изменившиеся поля. Каждому клиенту сообщения пишет своя задача из
+очереди: медленный клиент не задерживает изменения и других клиентов, а при
+переполнении очереди его соединение закрывается (он переподключится и
+перечитает состояние).
+"""
+import asyncio
+from contextvars import ContextVar
+import json
+
+from aiohttp import WSCloseCode
+
+EVENTS = ("device_changed", "sensors_updated")
+
+# Сообщений в очереди одного клиента до отключения
+QUEUE_SIZE = 1000
+
+class Subscriber:
+    def __init__(self, ws):
+        self.ws = ws
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.closed = False
+        self.events = set()   # на какие уведомления подписан; пусто - ни на какие
+        self.devices = None   # id устройств; None - все
+        self.types = None     # типы устройств; None - все
+        self.sensors = None   # имена датчиков; None - все
+
+    def subscribe(self, events=EVENTS, devices=None, types=None, sensors=None):
+        """Заменить фильтр; None в devices/types/sensors - без ограничения"""
+        unknown = set(events) - set(EVENTS)
+        if unknown:
+            raise ValueError(f"Неизвестные уведомления: {', '.join(sorted(unknown))}")
+        self.events = set(events)
+        self.devices = set(devices) if devices is not None else None
+        self.types = set(types) if types is not None else None
+        self.sensors = set(sensors) if sensors is not None else None
+
+    def wants_device(self, device_id, device_type):
+        return (
+            "device_changed" in self.events
+            and (self.devices is None or device_id in self.devices)
+            and (self.types is None or device_type in self.types)
+        )
+
+    def send(self, message: str):
+        """Поставить сообщение в очередь без ожидания; не успевает читать - отключаем"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.closed = True
+            closing = asyncio.ensure_future(self.ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b"Slow consumer"))
+            # Никто не ждет закрытия: ошибку (клиент уже отключился) забираем сами
+            closing.add_done_callback(consume_exception)
+
+    async def writer(self):
+        """Отправка сообщений из очереди по порядку; клиент отключился - выход"""
+        while True:
+            message = await self.queue.get()
+            try:
+                await self.ws.send_str(message)
+            except ConnectionError:
+                self.closed = True
+                return
+
+def consume_exception(task):
+    """done-callback: забрать исключение задачи, иначе asyncio пишет в лог
+    «Task exception was never retrieved»"""
+    if not task.cancelled():
+        task.exception()
+
+class Hub:
+    def __init__(self):
+        self.subscribers = set()
+
+    def notification(self, method, params):
+        return json.dumps({"jsonrpc": "2.0", "method": method, "params": params}, ensure_ascii=False)
+
+    def device_changed(self, device_id, device_type, changes, version):
+        targets = [s for s in self.subscribers if s.wants_device(device_id, device_type)]
+        if not targets:
+            return
+        # Одно сообщение на всех: сериализуем один раз
+        message = self.notification("device_changed", {"device_id": device_id, "type": device_type, "changes": changes, "version": version})
+        for subscriber in targets:
+            subscriber.send(message)
+
+    def sensors_updated(self, changes):
+        for subscriber in list(self.subscribers):
+            if "sensors_updated" not in subscriber.events:
+                continue
+            if subscriber.sensors is None:
+                wanted = changes
+            else:
+                wanted = {name: value for name, value in changes.items() if name in subscriber.sensors}
+            if wanted:
+                subscriber.send(self.notification("sensors_updated", {"changes": wanted}))
+
+hub = Hub()
+
+# Клиент WebSocket, чей запрос сейчас выполняется (None - запрос по HTTP).
+# Задачи пакета (batch_dispatch) копируют контекст, поэтому значение видно и в них
+current_subscriber: ContextVar = ContextVar("current_subscriber", default=None)
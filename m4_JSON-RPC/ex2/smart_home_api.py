@@ -1,123 +1,263 @@
 from aiohttp import web
-from jsonrpcserver import method, async_dispatch, Success
+from jsonrpcserver import method, Success
+from batch_dispatch import dispatch_batch
+from device_registry import DeviceRegistry
+from notifications import EVENTS, Subscriber, current_subscriber, hub
 import asyncio
+from contextlib import suppress
+import os
 import random
 
-# Имитация состояния устройств умного дома
-smart_home = {
-    "devices": {
-        "light_living_room": {"status": "off", "brightness": 0, "type": "light"},
-        "light_kitchen": {"status": "off", "brightness": 0, "type": "light"},
-        "thermostat": {"status": "on", "temperature": 22, "type": "climate"},
-        "tv": {"status": "off", "channel": 1, "volume": 20, "type": "media"},
-        "door_lock": {"status": "locked", "type": "security"}
+# Задержка связи с устройством, секунд (имитация Zigbee/Wi-Fi); 0 - без задержки
+DEVICE_LATENCY = float(os.getenv("SMART_HOME_LATENCY", "0"))
+# Сколько вызовов одного пакета выполняются одновременно; 0 - без ограничения
+BATCH_CONCURRENCY = int(os.getenv("SMART_HOME_BATCH_CONCURRENCY", "0"))
+
+# Устройства умного дома: состояние, индексы по типу и сценариям,
+# блокировки и версии - в реестре (device_registry.py)
+registry = DeviceRegistry(on_change=hub.device_changed)
+
+DEVICES = {
+    "light_living_room": {"status": "off", "brightness": 0, "type": "light"},
+    "light_kitchen": {"status": "off", "brightness": 0, "type": "light"},
+    "thermostat": {"status": "on", "temperature": 22, "type": "climate"},
+    "tv": {"status": "off", "channel": 1, "volume": 20, "type": "media"},
+    "door_lock": {"status": "locked", "type": "security"}
+}
+
+# Сценарии - данные: поля для конкретных устройств ("devices") и для всех
+# устройств типа ("types"); применяются одним проходом по индексу сценария
+SCENES = {
+    "movie_night": {
+        "devices": {
+            "light_living_room": {"status": "on", "brightness": 30},
+            "tv": {"status": "on", "volume": 40},
+        },
+        "actions": ["Свет в гостиной приглушен", "Телевизор включен"],
+    },
+    "cooking": {
+        "devices": {
+            "light_kitchen": {"status": "on", "brightness": 100},
+            "thermostat": {"temperature": 23},
+        },
+        "actions": ["Свет на кухне включен", "Температура установлена на 23°C"],
+    },
+    "away": {
+        "types": {
+            "light": {"status": "off"},
+            "media": {"status": "off"},
+            "security": {"status": "locked"},
+            "climate": {"temperature": 18},
+        },
+        "actions": ["Все освещение выключено", "Телевизор выключен", "Дверь заперта", "Температура снижена до 18°C"],
     },
-    "scenes": {
-        "movie_night": ["light_living_room", "tv"],
-        "cooking": ["light_kitchen", "thermostat"],
-        "away": ["light_living_room", "light_kitchen", "thermostat", "tv", "door_lock"]
-    }
 }
 
+for device_id, state in DEVICES.items():
+    registry.add(device_id, **state)
+for scene_id, scene in SCENES.items():
+    registry.define_scene(scene_id, **scene)
+
+# Показания датчиков; обновляются целиком, поэтому отдаются копией
+sensors = {}
+
 # Имитация датчиков
 async def update_sensors():
     while True:
-        smart_home["sensors"] = {
+        readings = {
             "temperature": round(random.uniform(18, 25), 1),
             "humidity": round(random.uniform(40, 60), 1),
             "motion_detected": random.choice([True, False])
         }
+        changes = {name: value for name, value in readings.items() if sensors.get(name) != value}
+        sensors.update(changes)
+        if changes:
+            hub.sensors_updated(changes)
         await asyncio.sleep(5)
 
+async def device_io():
+    """Обмен данными с устройством"""
+    if DEVICE_LATENCY:
+        await asyncio.sleep(DEVICE_LATENCY)
+
 # API методы
+# Команды устройству выполняются под его блокировкой: операции с одним
+# устройством идут по очереди, с разными - одновременно
 @method
 async def get_device_status(device_id):
     """Получить статус устройства"""
-    if device_id in smart_home["devices"]:
-        return Success(smart_home["devices"][device_id])
-    return Success({"error": "Устройство не найдено"})
+    if device_id not in registry:
+        return Success({"error": "Устройство не найдено"})
+    async with registry.locked([device_id]):
+        await device_io()
+        # Копия: ответ пакета сериализуется после всех вызовов, и следующий
+        # вызов того же пакета не должен менять уже прочитанное состояние
+        return Success(dict(registry.get(device_id)))
 
 @method
 async def set_device_status(device_id, status):
     """Изменить статус устройства (on/off)"""
-    if device_id in smart_home["devices"]:
-        smart_home["devices"][device_id]["status"] = status
-        return Success({"result": "success", "device": device_id, "status": status})
-    return Success({"error": "Устройство не найдено"})
+    if device_id not in registry:
+        return Success({"error": "Устройство не найдено"})
+    async with registry.locked([device_id]):
+        await device_io()
+        registry.update(device_id, status=status)
+    return Success({"result": "success", "device": device_id, "status": status})
 
 @method
 async def set_light_brightness(device_id, brightness):
     """Установить яркость света (0-100%)"""
-    if device_id in smart_home["devices"] and smart_home["devices"][device_id]["type"] == "light":
-        if 0 <= brightness <= 100:
-            smart_home["devices"][device_id]["brightness"] = brightness
-            if brightness > 0:
-                smart_home["devices"][device_id]["status"] = "on"
-            else:
-                smart_home["devices"][device_id]["status"] = "off"
-            return Success({"result": "success", "device": device_id, "brightness": brightness})
+    device = registry.get(device_id)
+    if device is None or device["type"] != "light":
+        return Success({"error": "Устройство не найдено или не является светильником"})
+    if not 0 <= brightness <= 100:
         return Success({"error": "Яркость должна быть от 0 до 100"})
-    return Success({"error": "Устройство не найдено или не является светильником"})
+    async with registry.locked([device_id]):
+        await device_io()
+        registry.update(device_id, brightness=brightness, status="on" if brightness > 0 else "off")
+    return Success({"result": "success", "device": device_id, "brightness": brightness})
 
 @method
 async def set_temperature(temperature):
     """Установить целевую температуру термостата"""
-    if 16 <= temperature <= 30:
-        smart_home["devices"]["thermostat"]["temperature"] = temperature
-        return Success({"result": "success", "temperature": temperature})
-    return Success({"error": "Температура должна быть от 16 до 30 градусов"})
+    if not 16 <= temperature <= 30:
+        return Success({"error": "Температура должна быть от 16 до 30 градусов"})
+    async with registry.locked(["thermostat"]):
+        await device_io()
+        registry.update("thermostat", temperature=temperature)
+    return Success({"result": "success", "temperature": temperature})
 
 @method
 async def activate_scene(scene_id):
-    """Активировать сценарий умного дома"""
-    if scene_id in smart_home["scenes"]:
-        results = []
-        if scene_id == "movie_night":
-            # Настройка для просмотра фильма
-            smart_home["devices"]["light_living_room"]["status"] = "on"
-            smart_home["devices"]["light_living_room"]["brightness"] = 30
-            smart_home["devices"]["tv"]["status"] = "on"
-            smart_home["devices"]["tv"]["volume"] = 40
-            results = ["Свет в гостиной приглушен", "Телевизор включен"]
-        elif scene_id == "cooking":
-            # Настройка для приготовления пищи
-            smart_home["devices"]["light_kitchen"]["status"] = "on"
-            smart_home["devices"]["light_kitchen"]["brightness"] = 100
-            smart_home["devices"]["thermostat"]["temperature"] = 23
-            results = ["Свет на кухне включен", "Температура установлена на 23°C"]
-        elif scene_id == "away":
-            # Настройка для режима "Никого нет дома"
-            smart_home["devices"]["light_living_room"]["status"] = "off"
-            smart_home["devices"]["light_kitchen"]["status"] = "off"
-            smart_home["devices"]["tv"]["status"] = "off"
-            smart_home["devices"]["door_lock"]["status"] = "locked"
-            smart_home["devices"]["thermostat"]["temperature"] = 18
-            results = ["Все освещение выключено", "Телевизор выключен", "Дверь заперта", "Температура снижена до 18°C"]
-        
-        return Success({"result": "success", "scene": scene_id, "actions": results})
-    return Success({"error": "Сценарий не найден"})
+    """Активировать сценарий умного дома: все его устройства одной командой"""
+    if scene_id not in registry.scenes:
+        return Success({"error": "Сценарий не найден"})
+    members = registry.scene_members[scene_id]
+    async with registry.locked(members):
+        await device_io()
+        registry.apply_scene(scene_id)
+    return Success({"result": "success", "scene": scene_id, "actions": registry.scenes[scene_id]["actions"]})
 
 @method
 async def get_all_devices():
     """Получить список всех устройств и их статусы"""
-    return Success(smart_home["devices"])
+    return Success(registry.snapshot())
+
+@method
+async def get_devices_by_type(type):
+    """Устройства одного типа (light, climate, media, security, ...)"""
+    return Success(registry.snapshot(registry.of_type(type)))
+
+@method
+async def get_devices_since(version=0, limit=0, epoch=None):
+    """Устройства, измененные после версии version (0 - все), и текущая версия.
+
+    Клиент хранит полученные "version" и "epoch" и передает их в следующий
+    раз. limit - не больше стольких устройств за вызов (0 - без ограничения);
+    если "more", вызвать еще раз с новой "version". epoch не совпадает
+    (сервер перезапущен, версии начались заново) - отдаются все устройства."""
+    changed, high_water, more = registry.changed_since(version, limit, epoch)
+    devices = {
+        device_id: {**registry.get(device_id), "version": registry.versions[device_id]}
+        for device_id in changed
+    }
+    return Success({"epoch": registry.epoch, "version": high_water, "devices": devices, "more": more})
 
 @method
 async def get_sensors_data():
     """Получить данные с датчиков"""
-    return Success(smart_home.get("sensors", {"error": "Датчики недоступны"}))
+    return Success(dict(sensors) if sensors else {"error": "Датчики недоступны"})
+
+@method
+async def subscribe(events=None, devices=None, types=None, sensors=None):
+    """Подписаться на уведомления (только по WebSocket /ws); повторный вызов
+    заменяет фильтр. devices/types/sensors - списки, не заданы - без ограничения"""
+    subscriber = current_subscriber.get()
+    if subscriber is None:
+        return Success({"error": "Подписка доступна только по WebSocket /ws"})
+    try:
+        subscriber.subscribe(events if events is not None else EVENTS, devices, types, sensors)
+    except ValueError as e:
+        return Success({"error": str(e)})
+    return Success({"result": "success", "events": sorted(subscriber.events)})
+
+@method
+async def unsubscribe():
+    """Отписаться от всех уведомлений"""
+    subscriber = current_subscriber.get()
+    if subscriber is None:
+        return Success({"error": "Подписка доступна только по WebSocket /ws"})
+    subscriber.subscribe(events=())
+    return Success({"result": "success"})
+
+def is_id(value):
+    """id из параметров вызова - только строка или число"""
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
+
+def device_keys(call):
+    """Устройства, которые меняет или читает вызов: вызовы пакета с общими
+    устройствами выполняются по порядку, остальные - параллельно"""
+    name, params = call.get("method"), call.get("params")
+    if name in ("get_all_devices", "get_devices_since"):
+        return tuple(registry)
+    if not isinstance(params, dict):
+        return ()
+    if name == "get_devices_by_type":
+        device_type = params.get("type")
+        return tuple(registry.of_type(device_type)) if is_id(device_type) else ()
+    if "device_id" in params:
+        return (params["device_id"],) if is_id(params["device_id"]) else ()
+    if name == "set_temperature":
+        return ("thermostat",)
+    if name == "activate_scene":
+        scene_id = params.get("scene_id")
+        return tuple(registry.scene_members.get(scene_id, ())) if is_id(scene_id) else ()
+    return ()
 
 # Обработчик JSON-RPC запросов
 async def handle_rpc(request):
     request_data = await request.text()
-    response = await async_dispatch(request_data)
-    return web.json_response(response)
+    response = await dispatch_batch(request_data, keys=device_keys, limit=BATCH_CONCURRENCY)
+    if not response:
+        return web.Response(status=204)
+    # dispatch уже вернул JSON-текст - отдаем как есть, без повторной сериализации
+    return web.Response(text=response, content_type="application/json")
 
-# Запуск сервера
-async def start_server():
+# JSON-RPC по WebSocket: те же методы, плюс subscribe/unsubscribe и уведомления
+async def handle_ws(request):
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    subscriber = Subscriber(ws)
+    current_subscriber.set(subscriber)
+    writer = asyncio.create_task(subscriber.writer())
+    hub.subscribers.add(subscriber)
+    try:
+        async for message in ws:
+            if message.type != web.WSMsgType.TEXT:
+                continue
+            response = await dispatch_batch(message.data, keys=device_keys, limit=BATCH_CONCURRENCY)
+            if response:
+                subscriber.send(response)
+    finally:
+        hub.subscribers.discard(subscriber)
+        subscriber.closed = True
+        # Задачу отправки дожидаемся: ее ошибка не теряется и не пишется в лог
+        # как "Task exception was never retrieved"
+        writer.cancel()
+        with suppress(asyncio.CancelledError):
+            await writer
+    return ws
+
+def create_app():
     app = web.Application()
     app.router.add_post("/api", handle_rpc)
     app.router.add_get("/api", handle_rpc)  # Для удобства тестирования
+    app.router.add_get("/ws", handle_ws)
+    return app
+
+# Запуск сервера
+async def start_server():
+    app = create_app()
     
     # Запуск имитации датчиков
     asyncio.create_task(update_sensors())
@@ -126,7 +266,7 @@ async def start_server():
     await runner.setup()
     site = web.TCPSite(runner, 'localhost', 5000)
     await site.start()
-    print("Сервер запущен на http://localhost:5000/api")
+    print("Сервер запущен на http://localhost:5000/api (WebSocket: ws://localhost:5000/ws)")
     
     # Держим сервер запущенным
     while True:
@@ -0,0 +1,39 @@
+"""Наблюдение за умным домом: уведомления об изменениях по WebSocket вместо опроса.
+
+Запуск: python smart_home_watch.py [тип устройства ...]
+(например, python smart_home_watch.py light - только светильники)
+"""
+import asyncio
+import json
+import sys
+
+import aiohttp
+
+WS_URL = "ws://localhost:5000/ws"
+
+async def watch(types=None):
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(WS_URL) as ws:
+            # Текущее состояние и подписка - одним пакетом
+            await ws.send_json([
+                {"jsonrpc": "2.0", "method": "get_all_devices", "id": 1},
+                {"jsonrpc": "2.0", "method": "subscribe", "params": {"types": types}, "id": 2},
+            ])
+            async for message in ws:
+                data = json.loads(message.data)
+                if isinstance(data, list):
+                    devices = data[0]["result"]
+                    print("Устройства:")
+                    print(json.dumps(devices, indent=2, ensure_ascii=False))
+                    print("\nОжидание изменений (Ctrl+C - выход)...")
+                elif data.get("method") == "device_changed":
+                    params = data["params"]
+                    print(f"{params['device_id']}: {params['changes']}")
+                elif data.get("method") == "sensors_updated":
+                    print(f"Датчики: {data['params']['changes']}")
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(watch(sys.argv[1:] or None))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,47 @@
+"""Проверки синхронизации по версиям (DeviceRegistry.changed_since).
+
+Запуск: python -m pytest test_sync.py (или python test_sync.py)
+"""
+from device_registry import DeviceRegistry
+
+def make_registry(devices=5):
+    registry = DeviceRegistry()
+    for i in range(devices):
+        registry.add(f"lamp_{i}", status="off", type="light")
+    return registry
+
+def test_same_epoch_returns_only_changes():
+    registry = make_registry()
+    version, epoch = registry.version, registry.epoch
+    registry.update("lamp_3", status="on")
+    changed, high_water, more = registry.changed_since(version, epoch=epoch)
+    assert changed == ["lamp_3"]
+    assert high_water == registry.version and not more
+
+def test_restarted_server_with_more_changes_returns_all():
+    # Клиент синхронизировался с первым запуском сервера
+    before = make_registry()
+    version, epoch = before.version, before.epoch
+
+    # Перезапуск: новый реестр успел сделать больше изменений, чем версия
+    # клиента, и номер клиента выглядит допустимым
+    after = make_registry()
+    for i in range(version + 10):
+        after.update("lamp_0", status="on" if i % 2 else "off")
+    assert after.version > version
+
+    changed, high_water, more = after.changed_since(version, epoch=epoch)
+    assert sorted(changed) == sorted(after)
+    assert high_water == after.version and not more
+
+def test_missing_epoch_returns_all():
+    registry = make_registry()
+    registry.update("lamp_1", status="on")
+    changed, _, _ = registry.changed_since(registry.version)
+    assert sorted(changed) == sorted(registry)
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+    print("OK")
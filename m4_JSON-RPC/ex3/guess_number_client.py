@@ -1,21 +1,20 @@
-import requests
 import json
 
+from rpc_client import RPCError, SyncRPCClient
+
 # URL JSON-RPC API
 API_URL = "http://localhost:5000/api"
 
+# Один клиент на всю сессию: соединение с сервером открывается один раз
+# и переиспользуется всеми вызовами (keep-alive)
+rpc = SyncRPCClient(API_URL)
+
 def call_method(method, params=None):
-    """Вызов метода JSON-RPC API"""
-    headers = {'Content-Type': 'application/json'}
-    payload = {
-        "jsonrpc": "2.0",
-        "method": method,
-        "params": params or {},
-        "id": 1
-    }
-    
-    response = requests.post(API_URL, json=payload, headers=headers)
-    return response.json()
+    """Вызов метода JSON-RPC API; ответ - {"result": ...} или {"error": ...}"""
+    try:
+        return {"result": rpc.call(method, params or {})}
+    except RPCError as e:
+        return {"error": e.error}
 
 def print_response(response):
     """Красивый вывод ответа"""
@@ -182,4 +181,7 @@ def main_menu():
             print("Неверный выбор. Попробуйте снова.")
 
 if __name__ == "__main__":
-    main_menu()
\ No newline at end of file
+    try:
+        main_menu()
+    finally:
+        rpc.close()
\ No newline at end of file
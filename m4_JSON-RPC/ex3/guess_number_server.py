@@ -1,7 +1,12 @@
 from aiohttp import web
-from jsonrpcserver import method, async_dispatch, Success
+from jsonrpcserver import method, Success
+from batch_dispatch import dispatch_batch
 import random
 import asyncio
+import os
+
+# Сколько вызовов одного пакета выполняются одновременно; 0 - без ограничения
+BATCH_CONCURRENCY = int(os.getenv("GAME_BATCH_CONCURRENCY", "0"))
 
 # Хранилище игровых сессий
 games = {}
@@ -159,22 +164,37 @@ async def game_stats(game_id):
     return Success({
         "attempts": game["attempts"],
         "status": game["status"],
-        "history": game["history"],
+        "history": list(game["history"]),
         "max_number": game["max_number"],
         "secret_number": game["secret_number"] if game["status"] != "active" else "???"
     })
 
+def game_keys(call):
+    """Вызовы пакета для одной игры выполняются по порядку (guess, затем
+    game_stats видит эту попытку), для разных игр - параллельно"""
+    params = call.get("params")
+    if isinstance(params, dict) and isinstance(params.get("game_id"), (str, int)):
+        return (params["game_id"],)
+    return ()
+
 # Обработчик JSON-RPC запросов
 async def handle_rpc(request):
     request_data = await request.text()
-    response = await async_dispatch(request_data)
-    return web.json_response(response)
+    response = await dispatch_batch(request_data, keys=game_keys, limit=BATCH_CONCURRENCY)
+    if not response:
+        return web.Response(status=204)
+    # dispatch уже вернул JSON-текст - отдаем как есть, без повторной сериализации
+    return web.Response(text=response, content_type="application/json")
 
-# Запуск сервера
-async def start_server():
+def create_app():
     app = web.Application()
     app.router.add_post("/api", handle_rpc)
     app.router.add_get("/api", handle_rpc)  # Для удобства тестирования
+    return app
+
+# Запуск сервера
+async def start_server():
+    app = create_app()
     
     runner = web.AppRunner(app)
     await runner.setup()
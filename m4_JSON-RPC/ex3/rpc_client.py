@@ -0,0 +1,143 @@
+"""Клиент JSON-RPC 2.0 поверх aiohttp: постоянные соединения и пакеты.
+
+- Соединения берутся из пула aiohttp и переиспользуются (keep-alive),
+  а не открываются заново на каждый вызов.
+- Вызовы, сделанные за одну итерацию event loop (например, в asyncio.gather)
+  или в течение window секунд, уходят одним пакетом - одним HTTP-запросом.
+- Ответы сопоставляются с вызовами по id, порядок ответов в пакете не важен.
+- У каждого вызова свой таймаут.
+
+    async with RPCClient("http://localhost:5000/api") as rpc:
+        tv, sensors = await asyncio.gather(
+            rpc.call("get_device_status", {"device_id": "tv"}),
+            rpc.call("get_sensors_data"),
+        )
+
+Для синхронного кода (консольные клиенты) - SyncRPCClient.
+
+Исходник - m4_JSON-RPC/shared/rpc_client.py; в примерах лежат его копии.
+Править исходник и запускать python m4_JSON-RPC/shared/sync.py (см. shared/README.md).
+"""
+import asyncio
+import itertools
+import threading
+
+import aiohttp
+
+class RPCError(Exception):
+    """Ответ JSON-RPC с ошибкой; error - объект error из ответа"""
+
+    def __init__(self, error):
+        self.error = error
+        self.code = error.get("code")
+        super().__init__(f"{error.get('code')}: {error.get('message')}")
+
+class RPCClient:
+    def __init__(self, url, window=0.0, max_batch=100, timeout=10.0, connections=10):
+        self.url = url
+        self.window = window  # 0 - пакет из вызовов одной итерации event loop
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.connections = connections
+        self.ids = itertools.count(1)
+        self.pending = []  # (запрос, future) - ждут отправки
+        self.flush_handle = None
+        self.sending = set()  # задачи отправки пакетов
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.connections))
+
+    async def close(self):
+        self.flush()
+        await asyncio.gather(*self.sending, return_exceptions=True)
+        await self.session.close()
+
+    async def call(self, method, params=None, timeout=None):
+        """Результат метода; ошибка JSON-RPC - исключение RPCError,
+        нет ответа за timeout секунд - asyncio.TimeoutError"""
+        request = {"jsonrpc": "2.0", "method": method, "id": next(self.ids)}
+        if params is not None:
+            request["params"] = params
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((request, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            if self.window:
+                self.flush_handle = loop.call_later(self.window, self.flush)
+            else:
+                self.flush_handle = loop.call_soon(self.flush)
+        return await asyncio.wait_for(future, timeout or self.timeout)
+
+    def flush(self):
+        """Отправить накопленные вызовы одним HTTP-запросом"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        task = asyncio.ensure_future(self.send(batch))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+    async def send(self, batch):
+        futures = {request["id"]: future for request, future in batch}
+        # Один вызов - обычный запрос, несколько - массив
+        payload = batch[0][0] if len(batch) == 1 else [request for request, _ in batch]
+        try:
+            async with self.session.post(self.url, json=payload) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+        except Exception as exc:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        # Ошибка без id (например, Invalid Request) относится ко всему пакету
+        batch_error = {"code": -32603, "message": "Сервер не ответил на вызов"}
+        for item in data if isinstance(data, list) else [data]:
+            future = futures.pop(item.get("id"), None)
+            if future is None:
+                batch_error = item.get("error", batch_error)
+            elif future.done():
+                pass  # вызов уже завершился по таймауту
+            elif "error" in item:
+                future.set_exception(RPCError(item["error"]))
+            else:
+                future.set_result(item.get("result"))
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(RPCError(batch_error))
+
+class SyncRPCClient:
+    """RPCClient для синхронного кода: event loop с пулом соединений
+    работает в фоновом потоке и живет между вызовами"""
+
+    def __init__(self, url, **options):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = RPCClient(url, **options)
+        self.run(self.client.open())
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def call(self, method, params=None, timeout=None):
+        return self.run(self.client.call(method, params, timeout))
+
+    def close(self):
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -0,0 +1,80 @@
+"""Пакетные JSON-RPC запросы с параллельным выполнением вызовов.
+
+Вызовы пакета выполняются одновременно (asyncio), поэтому пакет из 20
+запросов состояния стоит один round-trip и примерно одну задержку метода.
+Два правила сохраняют смысл пакета:
+
+- вызовы с общим ключом (например, одно устройство или одна игра)
+  выполняются в порядке пакета: «изменить, затем прочитать» читает уже
+  измененное значение;
+- limit ограничивает число одновременно выполняемых вызовов одного пакета.
+
+Одиночный запрос и некорректный пакет обрабатывает async_dispatch как обычно.
+
+Исходник - m4_JSON-RPC/shared/batch_dispatch.py; в примерах лежат его копии.
+Править исходник и запускать python m4_JSON-RPC/shared/sync.py (см. shared/README.md).
+"""
+import asyncio
+import json
+
+from jsonrpcserver import async_dispatch
+# dispatch_to_serializable - внутренняя функция jsonrpcserver: выполняет один
+# уже разобранный вызов и возвращает dict ответа. Публичный async_dispatch
+# принимает только текст и выполняет пакет целиком, поэтому версия
+# jsonrpcserver закреплена в requirements.txt
+from jsonrpcserver.async_main import dispatch_to_serializable
+
+def no_keys(call):
+    return ()
+
+def call_keys(call, keys):
+    """Ключи вызова. Если параметры некорректны (например, список вместо id)
+    и ключи не получить, вызов выполняется без упорядочивания - ошибку
+    вернет диспетчер, а не весь пакет"""
+    if not isinstance(call, dict):
+        return ()
+    try:
+        found = tuple(keys(call))
+        hash(found)
+    except TypeError:
+        return ()
+    return found
+
+async def dispatch_batch(body: str, keys=no_keys, limit: int = 0) -> str:
+    """Ответ на тело запроса (JSON-текст; пустая строка, если отвечать не нужно).
+
+    keys(call) - ключи вызова (dict запроса), по которым он упорядочивается
+    с предыдущими вызовами пакета; limit - 0, если без ограничения.
+    """
+    try:
+        calls = json.loads(body)
+    except ValueError:
+        calls = None
+    if not isinstance(calls, list) or not calls:
+        return await async_dispatch(body)
+
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def run(call, previous):
+        # Сначала - все более ранние вызовы с теми же ключами; семафор берется
+        # только после них, иначе ожидающие вызовы заняли бы все места
+        for task in previous:
+            await task
+        if semaphore is None:
+            return await dispatch_to_serializable(call, deserializer=lambda request: request)
+        async with semaphore:
+            return await dispatch_to_serializable(call, deserializer=lambda request: request)
+
+    last = {}  # ключ -> последняя задача пакета с этим ключом
+    tasks = []
+    for call in calls:
+        found = call_keys(call, keys)
+        previous = {last[key] for key in found if key in last}
+        task = asyncio.ensure_future(run(call, previous))
+        for key in found:
+            last[key] = task
+        tasks.append(task)
+
+    # Ответы - в порядке пакета, без уведомлений (вызовов без id)
+    responses = [response for response in await asyncio.gather(*tasks) if response is not None]
+    return json.dumps(responses, ensure_ascii=False) if responses else ""
@@ -0,0 +1,44 @@
+"""Копирует общие модули в примеры; --check только сравнивает копии с исходником.
+
+Запуск (из любой папки):
+    python m4_JSON-RPC/shared/sync.py          # обновить копии
+    python m4_JSON-RPC/shared/sync.py --check  # код 1, если какая-то копия отличается
+"""
+import os
+import sys
+
+SHARED_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULE_DIR = os.path.dirname(SHARED_DIR)
+
+# Модуль -> папки примеров (относительно m4_JSON-RPC), где лежат его копии
+COPIES = {
+    "rpc_client.py": ["ex1", "ex2", "ex3"],
+    "batch_dispatch.py": ["ex2", "ex3"],
+}
+
+def main(check: bool) -> int:
+    stale = []
+    for name, directories in COPIES.items():
+        with open(os.path.join(SHARED_DIR, name), "rb") as f:
+            source = f.read()
+        for directory in directories:
+            path = os.path.normpath(os.path.join(MODULE_DIR, directory, name))
+            try:
+                with open(path, "rb") as f:
+                    same = f.read() == source
+            except FileNotFoundError:
+                same = False
+            if same:
+                continue
+            stale.append(os.path.relpath(path, MODULE_DIR))
+            if not check:
+                with open(path, "wb") as f:
+                    f.write(source)
+    if check and stale:
+        print("Копии отличаются от m4_JSON-RPC/shared:", *stale, sep="\n  ")
+        return 1
+    print(f"Обновлено копий: {len(stale)}" if not check else "Копии совпадают с m4_JSON-RPC/shared")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main("--check" in sys.argv[1:]))
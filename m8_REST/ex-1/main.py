@@ -1,6 +1,8 @@
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Query, Response, status
 from pydantic import BaseModel
 from typing import List
+from bisect import bisect_right, insort
+import threading
 
 app = FastAPI(
     title="Blog API",
@@ -19,40 +21,63 @@ class Comment(BaseModel):
     post_id: int
     text: str
 
-# "База данных"
+# "База данных": словари по id, поиск и удаление за O(1)
 db = {
-    "posts": [
-        Post(id=1, title="Первая запись", content="Привет, мир!"),
-    ],
-    "comments": [
-        Comment(id=1, post_id=1, text="Отличный пост!"),
-    ],
+    "posts": {
+        1: Post(id=1, title="Первая запись", content="Привет, мир!"),
+    },
+    # post_id -> комментарии поста в порядке id
+    "comments": {
+        1: [Comment(id=1, post_id=1, text="Отличный пост!")],
+    },
 }
+# id постов по возрастанию - для постраничной выдачи бинарным поиском
+post_ids = sorted(db["posts"])
+# Синхронные обработчики выполняются параллельно в пуле потоков, а пост
+# хранится в двух структурах (db["posts"] и post_ids) - меняются и читаются
+# они вместе только под db_lock
+db_lock = threading.Lock()
 
-# Получить все посты
+def page(items, limit: int, response: Response):
+    """Курсор следующей страницы - в заголовке X-Next-Cursor (передать как ?after=)"""
+    if len(items) == limit:
+        response.headers["X-Next-Cursor"] = str(items[-1].id)
+    return items
+
+# Получить посты
 @app.get("/posts", 
          response_model=List[Post],
-         summary="Получить все посты",
-         description="Возвращает список всех постов в блоге")
-def get_posts():
-    return db["posts"]
+         summary="Получить посты",
+         description="Возвращает посты с id больше after, не более limit штук")
+def get_posts(response: Response, limit: int = Query(100, ge=1, le=1000), after: int = 0):
+    with db_lock:
+        start = bisect_right(post_ids, after)
+        posts = [db["posts"][i] for i in post_ids[start:start + limit]]
+    return page(posts, limit, response)
 
 # Создать пост
 @app.post("/posts", status_code=status.HTTP_201_CREATED)
 def create_post(post: Post):
-    db["posts"].append(post)
+    with db_lock:
+        if post.id in db["posts"]:
+            raise HTTPException(status_code=409, detail="Пост с таким id уже существует")
+        db["posts"][post.id] = post
+        insort(post_ids, post.id)
     return {"message": "Пост создан"}
 
 # Получить комментарии к посту
 @app.get("/posts/{post_id}/comments", response_model=List[Comment])
-def get_comments(post_id: int):
-    return [c for c in db["comments"] if c.post_id == post_id]
+def get_comments(post_id: int, response: Response, limit: int = Query(100, ge=1, le=1000), after: int = 0):
+    comments = db["comments"].get(post_id, [])
+    start = bisect_right(comments, after, key=lambda c: c.id)
+    return page(comments[start:start + limit], limit, response)
 
-# Удалить пост
+# Удалить пост вместе с комментариями
 @app.delete("/posts/{post_id}")
 def delete_post(post_id: int):
-    post = next((p for p in db["posts"] if p.id == post_id), None)
-    if not post:
-        raise HTTPException(status_code=404, detail="Пост не найден")
-    db["posts"].remove(post)
-    return {"message": "Пост удален"}
\ No newline at end of file
+    with db_lock:
+        if db["posts"].pop(post_id, None) is None:
+            raise HTTPException(status_code=404, detail="Пост не найден")
+        del post_ids[bisect_right(post_ids, post_id) - 1]
+        db["comments"].pop(post_id, None)
+    return {"message": "Пост удален"}
@@ -0,0 +1,129 @@
+"""Стресс-тест магазина (инварианты остатков при параллельных покупателях)
+и накладные расходы MetricsMiddleware.
+
+Запуск: python bench.py
+"""
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from uuid import uuid4
+import asyncio
+import random
+import time
+
+from fastapi.testclient import TestClient
+
+import shop
+from metrics import MetricsMiddleware
+
+# В контексте у клиента один event loop на все потоки, обработчики
+# при этом выполняются параллельно в пуле потоков, как под uvicorn
+client = TestClient(shop.app)
+
+def shopper(seed, rounds=40):
+    """Покупатель со своей корзиной кладет случайные товары и время от времени
+    оформляет заказ; сумму заказа сверяет с тем, что положил в корзину"""
+    rng = random.Random(seed)
+    headers = {"X-Session-Id": uuid4().hex}
+    expected_total = 0
+    placed = mismatched = 0
+    for _ in range(rounds):
+        product = rng.choice(shop.products)
+        quantity = rng.randint(1, 3)
+        response = client.post("/cart", json={"product_id": product.id, "quantity": quantity}, headers=headers)
+        if response.status_code == 200:
+            expected_total += product.price * quantity
+        if rng.random() < 0.3:
+            response = client.post("/order", headers=headers)
+            if response.status_code == 200:
+                placed += 1
+                mismatched += response.json()["total"] != expected_total
+                expected_total = 0
+    return placed, mismatched
+
+def bench_stock_invariants(clients=64, stock=300):
+    """Параллельные покупатели: остаток + продано == начальный остаток,
+    остаток не уходит в минус, каждый заказ содержит ровно то, что положили в корзину"""
+    for product in shop.products:
+        product.stock = stock
+    orders_before = len(shop.orders)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(shopper, range(clients)))
+    elapsed = time.perf_counter() - start
+
+    sold = {product.id: 0 for product in shop.products}
+    for order in shop.orders[orders_before:]:
+        for item in order.items:
+            sold[item.product_id] += item.quantity
+    placed = sum(p for p, _ in results)
+    mismatched = sum(m for _, m in results)
+    print(f"Покупателей: {clients}, заказов: {placed} за {elapsed:.1f} с")
+    for product in shop.products:
+        print(f"Товар {product.id}: остаток {product.stock}, продано {sold[product.id]}, "
+              f"расхождение {stock - product.stock - sold[product.id]}")
+    print(f"Заказов с неверной суммой: {mismatched}")
+    assert placed == len(shop.orders) - orders_before
+    assert mismatched == 0
+    for product in shop.products:
+        assert product.stock >= 0 and product.stock + sold[product.id] == stock
+
+async def asgi_get(stack, path, query=b""):
+    """GET напрямую в ASGI-приложение, без HTTP-клиента - чтобы его время не
+    скрывало разницу в несколько микросекунд"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query,
+        "root_path": "", "headers": [], "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+        "app": shop.app,
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    async def receive():
+        # После тела запроса - ожидание, как у соединения без разрыва
+        # (StreamingResponse слушает receive, пока отдает ответ)
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+    async def send(message):
+        pass
+    await stack(scope, receive, send)
+
+async def measure_stacks(stacks, path, query, rounds=10, requests=200):
+    """Время запроса (мкс, медиана по раундам) для каждого варианта;
+    варианты чередуются, чтобы фоновая нагрузка влияла на них одинаково"""
+    samples = {name: [] for name in stacks}
+    for _ in range(rounds):
+        for name, stack in stacks.items():
+            start = time.perf_counter()
+            for _ in range(requests):
+                await asgi_get(stack, path, query)
+            samples[name].append((time.perf_counter() - start) / requests * 1e6)
+    return {name: median(values) for name, values in samples.items()}
+
+async def empty_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+def bench_metrics_overhead():
+    """Один и тот же стек приложения с MetricsMiddleware и без него,
+    и сама middleware вокруг пустого ASGI-приложения"""
+    with_metrics = shop.app.build_middleware_stack()
+    saved = shop.app.user_middleware
+    shop.app.user_middleware = [m for m in saved if m.cls is not MetricsMiddleware]
+    without_metrics = shop.app.build_middleware_stack()
+    shop.app.user_middleware = saved
+
+    print(f"{'запрос':<28}{'без метрик, мкс':>18}{'с метриками, мкс':>19}{'разница, мкс':>15}")
+    for name, stacks, path, query in (
+        ("пустое приложение", (empty_app, MetricsMiddleware(empty_app)), "/", b""),
+        ("/products/1", (without_metrics, with_metrics), "/products/1", b""),
+        ("/products?limit=100", (without_metrics, with_metrics), "/products", b"limit=100"),
+    ):
+        result = asyncio.run(measure_stacks(dict(zip(("без", "с"), stacks)), path, query))
+        plain, metered = result["без"], result["с"]
+        print(f"{name:<28}{plain:>18.1f}{metered:>19.1f}{metered - plain:>15.1f}")
+
+if __name__ == "__main__":
+    with client:
+        bench_stock_invariants()
+    bench_metrics_overhead()
@@ -1,8 +1,19 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Depends, Header, Cookie, Body, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+from bisect import bisect_right
+from collections import OrderedDict
+from uuid import uuid4
+import threading
+import time
+
+from metrics import MetricsMiddleware, metrics_endpoint
 
 app = FastAPI(title="Интернет-магазин", description="Простой REST API для интернет-магазина", version="1.0.0")
+# Время, коды ответов и число запросов по маршрутам - GET /metrics (формат Prometheus)
+app.add_middleware(MetricsMiddleware)
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
 
 class Product(BaseModel):
     id: int
@@ -25,78 +36,296 @@ products = [
     Product(id=3, name="Наушники", price=5000, stock=20)
 ]
 
-cart = []
+# Синхронные обработчики выполняются параллельно в пуле потоков, поэтому
+# общие данные меняются только под блокировками:
+#   product_locks - своя блокировка у каждого товара (остаток),
+#   carts_lock    - словарь корзин и их содержимое,
+#   orders_lock   - счетчик и список заказов, версии для ETag.
+# Блокировки товаров берутся в порядке id, поэтому взаимных блокировок нет
+products_by_id = {p.id: p for p in products}
+product_locks = {p.id: threading.Lock() for p in products}
+
+# Корзины пользователей: session_id -> (истекает_в, [CartItem]).
+# Порядок - по последнему обращению, поэтому брошенные корзины
+# удаляются с начала словаря без полного перебора
+CART_TTL = 30 * 60
+carts = OrderedDict()
+carts_lock = threading.Lock()
 orders = []
 order_counter = 1
+orders_lock = threading.Lock()
+
+# Ответы POST /order по заголовку Idempotency-Key: "session_id:ключ" -> (истекает_в, ответ).
+# Пока первый запрос выполняется, вместо ответа хранится threading.Event
+IDEMPOTENCY_TTL = 24 * 60 * 60
+idempotency_keys = OrderedDict()
+idempotency_lock = threading.Lock()
+
+# Версии данных для ETag: увеличиваются при каждом изменении списка
+versions = {"products": 0, "orders": 0}
+# Каталог общий для всех, заказы кэшировать могут только клиенты;
+# no-cache - хранить можно, но перед использованием проверять по ETag
+CACHE_CONTROL = {"products": "public, no-cache", "orders": "private, no-cache"}
+
+def get_session_id(
+    response: Response,
+    x_session_id: Optional[str] = Header(None),
+    session_id: Optional[str] = Cookie(None),
+):
+    """Идентификатор покупателя: заголовок X-Session-Id или cookie session_id.
+    Новому покупателю выдается cookie."""
+    if x_session_id or session_id:
+        return x_session_id or session_id
+    new_session_id = uuid4().hex
+    response.set_cookie("session_id", new_session_id, max_age=CART_TTL, httponly=True)
+    return new_session_id
+
+def get_cart_items(session_id: str = Depends(get_session_id)):
+    """Корзина покупателя; каждое обращение продлевает ее жизнь на CART_TTL.
+    Содержимое корзины читать и менять - под carts_lock."""
+    now = time.monotonic()
+    with carts_lock:
+        while carts:
+            oldest_session, (expires_at, _) = next(iter(carts.items()))
+            if expires_at > now:
+                break
+            del carts[oldest_session]
+        _, cart = carts.pop(session_id, (None, []))
+        carts[session_id] = (now + CART_TTL, cart)
+    return cart
+
+def add_items(cart: list, items):
+    """Добавить строки в корзину (под carts_lock)"""
+    in_cart = {c.product_id: c for c in cart}
+    for item in items:
+        if item.product_id in in_cart:
+            in_cart[item.product_id].quantity += item.quantity
+        else:
+            in_cart[item.product_id] = item.model_copy()
+            cart.append(in_cart[item.product_id])
+
+def parse_fields(fields: Optional[str], model):
+    """Проекция: ?fields=id,name -> список полей модели"""
+    allowed = list(model.model_fields)
+    if not fields:
+        return allowed
+    # Повтор поля (?fields=id,id) - одно поле: без дублей ключей в JSON
+    # и одной записи кэша на одинаковые проекции
+    names = list(dict.fromkeys(fields.split(",")))
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(unknown)}")
+    return names
+
+def cache_headers(table):
+    """Заголовки ETag и Cache-Control для текущей версии table"""
+    return {"ETag": f'"{table}-{versions[table]}"', "Cache-Control": CACHE_CONTROL[table]}
+
+def not_modified(headers, if_none_match: Optional[str]):
+    """Ответ 304, если у клиента уже текущая версия (заголовок If-None-Match)"""
+    if not if_none_match:
+        return None
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if "*" in tags or headers["ETag"] in tags:
+        return Response(status_code=304, headers=headers)
+    return None
+
+# Элементов в одной части потокового ответа: отправка каждого элемента
+# отдельной частью стоит дороже его сериализации
+PAGE_CHUNK = 100
+
+def paginate(items, after: int, limit: int, names, headers):
+    """Keyset-пагинация по списку, отсортированному по id.
+
+    Начало страницы ищется бинарным поиском, JSON отдается потоком частями
+    по PAGE_CHUNK элементов. Модели уже проверены, поэтому каждая сразу
+    сериализуется pydantic (model_dump_json), без промежуточного dict.
+    Курсор следующей страницы - в заголовке X-Next-Cursor (передать как ?after=).
+    """
+    start = bisect_right(items, after, key=lambda item: item.id)
+    page = items[start:start + limit]
+    include = set(names)
+    
+    def chunks():
+        yield "["
+        for i in range(0, len(page), PAGE_CHUNK):
+            yield ("," if i else "") + ",".join(item.model_dump_json(include=include) for item in page[i:i + PAGE_CHUNK])
+        yield "]"
+    
+    if len(page) == limit:
+        headers = {**headers, "X-Next-Cursor": str(page[-1].id)}
+    return StreamingResponse(chunks(), media_type="application/json", headers=headers)
 
-@app.get("/products", summary="Получить все товары")
-def get_products():
-    return products
+@app.get("/products", summary="Получить товары (постранично)")
+def get_products(
+    limit: int = Query(100, ge=1, le=1000),
+    after: int = 0,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    names = parse_fields(fields, Product)
+    headers = cache_headers("products")
+    return not_modified(headers, if_none_match) or paginate(products, after, limit, names, headers)
 
 @app.get("/products/{product_id}", summary="Получить товар по ID")
-def get_product(product_id: int):
-    product = next((p for p in products if p.id == product_id), None)
+def get_product(product_id: int, response: Response, if_none_match: Optional[str] = Header(None)):
+    product = products_by_id.get(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Товар не найден")
-    return product
+    headers = cache_headers("products")
+    response.headers.update(headers)
+    return not_modified(headers, if_none_match) or product
 
 @app.post("/cart", summary="Добавить товар в корзину")
-def add_to_cart(item: CartItem):
-    product = next((p for p in products if p.id == item.product_id), None)
+def add_to_cart(item: CartItem, cart: list = Depends(get_cart_items)):
+    product = products_by_id.get(item.product_id)
     if not product or product.stock < item.quantity:
         raise HTTPException(status_code=400, detail="Товар недоступен")
     
-    existing = next((c for c in cart if c.product_id == item.product_id), None)
-    if existing:
-        existing.quantity += item.quantity
-    else:
-        cart.append(item)
+    with carts_lock:
+        add_items(cart, [item])
     return {"message": "Добавлено в корзину"}
 
+MAX_BATCH = 100
+
+@app.post("/cart/batch", summary="Добавить несколько товаров в корзину")
+def add_to_cart_batch(
+    items: List[CartItem] = Body(..., min_length=1, max_length=MAX_BATCH),
+    cart: list = Depends(get_cart_items),
+):
+    """Строки проверяются по отдельности; в ответе - результат по каждой строке"""
+    accepted, results = [], []
+    for item in items:
+        product = products_by_id.get(item.product_id)
+        if not product or product.stock < item.quantity:
+            results.append({"product_id": item.product_id, "ok": False, "error": "Товар недоступен"})
+            continue
+        accepted.append(item)
+        results.append({"product_id": item.product_id, "ok": True})
+    with carts_lock:
+        add_items(cart, accepted)
+    return {"items": results}
+
 @app.get("/cart", summary="Просмотр корзины")
-def get_cart():
+def get_cart(cart: list = Depends(get_cart_items)):
     cart_details = []
     total = 0
-    for item in cart:
-        product = next(p for p in products if p.id == item.product_id)
-        subtotal = product.price * item.quantity
+    with carts_lock:
+        lines = [(item.product_id, item.quantity) for item in cart]
+    for product_id, quantity in lines:
+        product = products_by_id[product_id]
+        subtotal = product.price * quantity
         cart_details.append({
             "product": product.name,
             "price": product.price,
-            "quantity": item.quantity,
+            "quantity": quantity,
             "subtotal": subtotal
         })
         total += subtotal
     return {"items": cart_details, "total": total}
 
-@app.post("/order", summary="Создать заказ")
-def create_order():
+def reserve_stock(items):
+    """Списание всей корзины или ничего: остатки проверяются и уменьшаются
+    под блокировками всех товаров заказа, взятыми в порядке id"""
+    locks = [product_locks[product_id] for product_id in sorted({item.product_id for item in items})]
+    for lock in locks:
+        lock.acquire()
+    try:
+        if any(products_by_id[item.product_id].stock < item.quantity for item in items):
+            return False
+        for item in items:
+            products_by_id[item.product_id].stock -= item.quantity
+        return True
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+def place_order(cart: list):
     global order_counter
-    if not cart:
+    # Забираем содержимое корзины целиком: параллельный POST /cart
+    # попадет либо в этот заказ, либо уже в опустевшую корзину
+    with carts_lock:
+        items = cart.copy()
+        cart.clear()
+    if not items:
         raise HTTPException(status_code=400, detail="Корзина пуста")
+    if not reserve_stock(items):
+        with carts_lock:
+            add_items(cart, items)
+        raise HTTPException(status_code=400, detail="Недостаточно товара")
     
-    total = 0
-    for item in cart:
-        product = next(p for p in products if p.id == item.product_id)
-        if product.stock < item.quantity:
-            raise HTTPException(status_code=400, detail="Недостаточно товара")
-        total += product.price * item.quantity
-        product.stock -= item.quantity
-    
-    order = Order(id=order_counter, items=cart.copy(), total=total)
-    orders.append(order)
-    cart.clear()
-    order_counter += 1
+    total = sum(products_by_id[item.product_id].price * item.quantity for item in items)
+    with orders_lock:
+        order = Order(id=order_counter, items=items, total=total)
+        orders.append(order)
+        order_counter += 1
+        versions["products"] += 1
+        versions["orders"] += 1
     return {"order_id": order.id, "total": total}
 
-@app.get("/orders", summary="Получить все заказы")
-def get_orders():
-    return orders
+def claim_idempotency_key(key: str):
+    """Ответ на повтор запроса с ключом key или None, если запрос выполняем мы.
+    Параллельный повтор ждет, пока первый запрос завершится, и получает его ответ"""
+    while True:
+        with idempotency_lock:
+            now = time.monotonic()
+            while idempotency_keys:
+                oldest_key, (expires_at, value) = next(iter(idempotency_keys.items()))
+                if expires_at > now or isinstance(value, threading.Event):
+                    break
+                del idempotency_keys[oldest_key]
+            entry = idempotency_keys.get(key)
+            if entry is None:
+                idempotency_keys[key] = (now + IDEMPOTENCY_TTL, threading.Event())
+                return None
+        _, value = entry
+        if not isinstance(value, threading.Event):
+            return value
+        value.wait()
+
+@app.post("/order", summary="Создать заказ")
+def create_order(
+    response: Response,
+    cart: list = Depends(get_cart_items),
+    session_id: str = Depends(get_session_id),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
+    if not idempotency_key:
+        return place_order(cart)
+    
+    key = f"{session_id}:{idempotency_key}"
+    replayed = claim_idempotency_key(key)
+    if replayed is not None:
+        response.headers["Idempotent-Replayed"] = "true"
+        return replayed
+    
+    result = None
+    try:
+        result = place_order(cart)
+        return result
+    finally:
+        with idempotency_lock:
+            _, done = idempotency_keys.pop(key)
+            # Ошибку не запоминаем: повтор с тем же ключом выполнится заново
+            if result is not None:
+                idempotency_keys[key] = (time.monotonic() + IDEMPOTENCY_TTL, result)
+        done.set()
+
+@app.get("/orders", summary="Получить заказы (постранично)")
+def get_orders(
+    limit: int = Query(100, ge=1, le=1000),
+    after: int = 0,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    names = parse_fields(fields, Order)
+    headers = cache_headers("orders")
+    return not_modified(headers, if_none_match) or paginate(orders, after, limit, names, headers)
 
 @app.delete("/cart/{product_id}", summary="Удалить товар из корзины")
-def remove_from_cart(product_id: int):
-    global cart
-    cart = [item for item in cart if item.product_id != product_id]
+def remove_from_cart(product_id: int, cart: list = Depends(get_cart_items)):
+    with carts_lock:
+        cart[:] = [item for item in cart if item.product_id != product_id]
     return {"message": "Удалено из корзины"}
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+"""Бенчмарки SQLite-магазина.
+
+Запуск: python bench.py
+Использует временную БД, shop.db не трогает.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+if "SHOP_DB_URL" not in os.environ:
+    os.environ["SHOP_DB_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+import httpx
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import shop
+import shop_async
+
+client = TestClient(shop.app)
+
+# Счетчик SQL-запросов к БД
+queries = 0
+
+def count_query(*args):
+    global queries
+    queries += 1
+
+for engine in {shop.engine, shop.read_engine}:
+    event.listen(engine, "before_cursor_execute", count_query)
+
+def fill_catalog(n):
+    """Добавить в каталог n товаров с большим запасом"""
+    with shop.SessionLocal() as db:
+        db.query(shop.CartDB).delete()
+        db.query(shop.ProductDB).filter(shop.ProductDB.id > 3).delete()
+        db.add_all([shop.ProductDB(id=i, name=f"Товар {i}", price=100, stock=10**6) for i in range(4, n + 4)])
+        db.commit()
+
+def count_queries(method, url):
+    global queries
+    queries = 0
+    getattr(client, method)(url)
+    return queries
+
+def bench_cart_queries():
+    """Число запросов GET /cart и POST /order не зависит от размера корзины"""
+    print("Строк в корзине | GET /cart | POST /order")
+    for size in (1, 10, 50):
+        fill_catalog(size)
+        for product_id in range(4, size + 4):
+            client.post("/cart", json={"product_id": product_id, "quantity": 1})
+        cart_queries = count_queries("get", "/cart")
+        order_queries = count_queries("post", "/order")
+        print(f"{size:15} | {cart_queries:9} | {order_queries:11}")
+
+def order_worker(attempts):
+    """Процесс-покупатель: кладет товар 1 в корзину и оформляет заказ"""
+    statuses = {}
+    for _ in range(attempts):
+        client.post("/cart", json={"product_id": 1, "quantity": 1})
+        status = client.post("/order").status_code
+        statuses[status] = statuses.get(status, 0) + 1
+    return statuses
+
+def bench_oversell(workers=8, stock=50, attempts=20):
+    """Параллельные заказы одного товара не уводят остаток в минус"""
+    with shop.SessionLocal() as db:
+        db.query(shop.CartDB).delete()
+        db.query(shop.OrderDB).delete()
+        db.query(shop.ProductDB).filter_by(id=1).update({"stock": stock})
+        db.commit()
+    
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        results = pool.map(order_worker, [attempts] * workers)
+    
+    with shop.SessionLocal() as db:
+        left = db.query(shop.ProductDB).filter_by(id=1).one().stock
+        sold = sum(
+            item["quantity"]
+            for order in db.query(shop.OrderDB).all()
+            for item in json.loads(order.items)
+            if item["product_id"] == 1
+        )
+    statuses = {}
+    for result in results:
+        for status, count in result.items():
+            statuses[status] = statuses.get(status, 0) + count
+    print(f"Процессов: {workers}, ответы: {statuses}")
+    print(f"Остаток: {left}, продано: {sold}, перепродано: {max(0, sold - stock)}")
+    assert left >= 0 and sold + left == stock
+
+def restock():
+    """Большой запас товаров, чтобы заказы не упирались в остаток"""
+    with shop.SessionLocal() as db:
+        db.query(shop.ProductDB).update({"stock": 10**9})
+        db.commit()
+
+def mixed_worker(seconds, write_every=5):
+    """Смешанная нагрузка: на каждую запись (/cart + /order) - несколько чтений /products"""
+    reads = writes = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        client.get("/products")
+        reads += 1
+        if reads % write_every == 0:
+            client.post("/cart", json={"product_id": 1, "quantity": 1})
+            client.post("/order")
+            writes += 1
+    return reads, writes
+
+def bench_profiles(workers=4, seconds=3):
+    """Пропускная способность разных профилей движка на смешанной нагрузке"""
+    print("Профиль | чтений/с | заказов/с")
+    for name in shop.DB_PROFILES:
+        # Каждый профиль - в своей БД и своих процессах, т.к. движок создается при импорте
+        os.environ["SHOP_DB_PROFILE"] = name
+        os.environ["SHOP_DB_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+        # Схему и начальные данные создаем заранее, иначе процессы гоняются за create_all
+        subprocess.run([sys.executable, "-c", "import shop"], cwd=os.path.dirname(__file__) or ".", check=True)
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers, initializer=restock) as pool:
+            results = pool.map(mixed_worker, [seconds] * workers)
+        reads = sum(r for r, w in results) / seconds
+        writes = sum(w for r, w in results) / seconds
+        print(f"{name:7} | {reads:8.0f} | {writes:9.0f}")
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def measure_latency(app, concurrency, rounds, url="/products"):
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://shop") as http:
+        async def one_request():
+            start = time.perf_counter()
+            await http.get(url)
+            latencies.append(time.perf_counter() - start)
+        for _ in range(rounds):
+            await asyncio.gather(*(one_request() for _ in range(concurrency)))
+    return latencies
+
+def bench_async(concurrency=500, rounds=4):
+    """Задержка GET /products при большом числе одновременных запросов: sync против async"""
+    print(f"Одновременных запросов: {concurrency}")
+    print("Версия | p50, мс | p99, мс")
+    for name, app in (("sync", shop.app), ("async", shop_async.app)):
+        latencies = asyncio.run(measure_latency(app, concurrency, rounds))
+        print(f"{name:6} | {percentile(latencies, 50) * 1000:7.1f} | {percentile(latencies, 99) * 1000:7.1f}")
+
+def bench_cache(products=1000, concurrency=20, rounds=50):
+    """Задержка чтения каталога (страницы по 100 товаров) без кэша и с кэшем"""
+    fill_catalog(products)
+    print("Кэш каталога | p50, мс | p99, мс")
+    for name, ttl in (("выключен", 0), ("включен", 30)):
+        for cache in (shop.page_cache, shop.product_cache):
+            cache.ttl = ttl
+            cache.invalidate()
+            cache.hits = cache.misses = 0
+        latencies = []
+        for after in range(0, products, 100):
+            latencies += asyncio.run(measure_latency(shop.app, concurrency, rounds // 10, f"/products?after={after}"))
+        print(f"{name:12} | {percentile(latencies, 50) * 1000:7.1f} | {percentile(latencies, 99) * 1000:7.1f}")
+    print("Статистика кэша:", client.get("/stats/cache").json()["products"])
+
+def bench_cart_batch(lines=30, repeats=20):
+    """Корзина из lines строк: отдельные POST /cart против одного POST /cart/batch"""
+    global queries
+    fill_catalog(lines)
+    items = [{"product_id": product_id, "quantity": 1} for product_id in range(4, lines + 4)]
+    
+    def single():
+        for item in items:
+            client.post("/cart", json=item)
+    
+    def batch():
+        client.post("/cart/batch", json=items)
+    
+    print(f"Корзина из {lines} строк | запросов SQL | мс")
+    for name, fill in (("по одной строке", single), ("пакетом", batch)):
+        queries = 0
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fill()
+            client.delete("/cart/4")
+        elapsed = (time.perf_counter() - start) / repeats * 1000
+        print(f"{name:22} | {queries // repeats:12} | {elapsed:5.1f}")
+
+def bench_idempotency(retries=8):
+    """Параллельные повторы POST /order с одним Idempotency-Key создают один заказ"""
+    fill_catalog(1)
+    headers = {"X-Session-Id": uuid4().hex, "Idempotency-Key": uuid4().hex}
+    client.post("/cart", json={"product_id": 4, "quantity": 1}, headers=headers)
+    with shop.SessionLocal() as db:
+        before = db.query(shop.OrderDB).count()
+    
+    with ThreadPoolExecutor(retries) as pool:
+        responses = list(pool.map(lambda _: client.post("/order", headers=headers), range(retries)))
+    
+    with shop.SessionLocal() as db:
+        created = db.query(shop.OrderDB).count() - before
+    replayed = sum(r.headers.get("Idempotent-Replayed") == "true" for r in responses)
+    print(f"Повторов: {retries}, ответы: {sorted({r.status_code for r in responses})}, "
+          f"из сохраненных: {replayed}, создано заказов: {created}")
+    assert created == 1 and len({r.json()["order_id"] for r in responses}) == 1
+
+if __name__ == "__main__":
+    bench_cart_queries()
+    bench_oversell()
+    bench_profiles()
+    bench_async()
+    bench_cache()
+    bench_cart_batch()
+    bench_idempotency()
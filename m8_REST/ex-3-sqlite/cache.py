@@ -0,0 +1,65 @@
+"""In-process LRU-кэш с временем жизни записей для чтения каталога."""
+from collections import OrderedDict
+import threading
+import time
+
+MISSING = object()
+
+class TTLCache:
+    """LRU-кэш: не больше maxsize записей, каждая живет ttl секунд.
+
+    Считает попадания и промахи. Чтобы запись, прочитанная из БД до
+    инвалидации, не попала в кэш после нее, set принимает версию кэша,
+    полученную до чтения (см. version), и игнорирует устаревшие записи.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, version):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, keys=None):
+        """Удалить записи keys (или все записи, если keys не задан)"""
+        with self._lock:
+            self.version += 1
+            if keys is None:
+                self._data.clear()
+            else:
+                for key in keys:
+                    self._data.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -1,13 +1,87 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Header, Cookie, Body, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, create_engine
+from typing import List, Optional
+from sqlalchemy import create_engine, event, inspect, text, func, exists, or_, Index, Column, Integer, String, Float, Text, DateTime, ForeignKey, select, insert, update, delete, bindparam
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import sessionmaker, Session, relationship, joinedload
+from datetime import datetime, timedelta
+from uuid import uuid4
+from cache import TTLCache, MISSING
+from metrics import MetricsMiddleware, metrics_endpoint, count_call
+from fast_json import dumps
 import json
+import os
+import time
 
 app = FastAPI(title="Shop API")
-engine = create_engine("sqlite:///shop.db")
+# Время, коды ответов и обращения к БД по маршрутам - GET /metrics (формат Prometheus)
+app.add_middleware(MetricsMiddleware, backends=("sql",))
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+# Настройки БД (переменные окружения)
+DB_URL = os.getenv("SHOP_DB_URL", "sqlite:///shop.db")
+DB_PROFILE = os.getenv("SHOP_DB_PROFILE", "wal")
+CART_TTL = int(os.getenv("SHOP_CART_TTL", "1800"))  # секунд бездействия до удаления корзины
+CACHE_TTL = float(os.getenv("SHOP_CACHE_TTL", "30"))  # 0 - кэш каталога выключен
+CACHE_SIZE = int(os.getenv("SHOP_CACHE_SIZE", "1024"))
+IDEMPOTENCY_TTL = int(os.getenv("SHOP_IDEMPOTENCY_TTL", "86400"))  # сколько секунд помнить Idempotency-Key
+
+# Профили движка SQLite:
+#   default - как по умолчанию в SQLite: журнал отката, общий пул соединений
+#   wal     - WAL-журнал (чтение не ждет записи), одно соединение-писатель
+#             и отдельный пул соединений только для чтения
+DB_PROFILES = {
+    "default": {
+        "pragmas": {},
+        "writer_pool": {},
+        "reader_pool": None,
+    },
+    "wal": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 256 * 1024 * 1024,
+            "cache_size": -64000,  # в КиБ, т.е. ~64 МБ
+            "busy_timeout": 5000,
+        },
+        "writer_pool": {"pool_size": 1, "max_overflow": 0, "pool_timeout": 30},
+        "reader_pool": {"pool_size": 8, "max_overflow": 8},
+    },
+}
+
+def attach_pragmas(target_engine, pragmas, read_only=False):
+    """Выполнять PRAGMA на каждом новом соединении движка"""
+    @event.listens_for(target_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+def count_queries(target_engine):
+    """Каждый SQL-запрос движка (executemany - один) учитывается в метриках текущего HTTP-запроса"""
+    @event.listens_for(target_engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        count_call("sql")
+
+def make_engine(pragmas, read_only=False, **pool):
+    new_engine = create_engine(DB_URL, **pool)
+    attach_pragmas(new_engine, pragmas, read_only)
+    count_queries(new_engine)
+    return new_engine
+
+profile = DB_PROFILES[DB_PROFILE]
+engine = make_engine(profile["pragmas"], **profile["writer_pool"])
+if profile["reader_pool"] is None:
+    read_engine = engine
+else:
+    read_engine = make_engine(profile["pragmas"], read_only=True, **profile["reader_pool"])
 SessionLocal = sessionmaker(bind=engine)
+ReadSessionLocal = sessionmaker(bind=read_engine)
 Base = declarative_base()
 
 class ProductDB(Base):
@@ -20,17 +94,86 @@ class ProductDB(Base):
 class CartDB(Base):
     __tablename__ = "cart"
     id = Column(Integer, primary_key=True)
-    product_id = Column(Integer)
+    session_id = Column(String)
+    product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Integer)
+    updated_at = Column(DateTime, index=True)
+    product = relationship(ProductDB)
+    __table_args__ = (Index("ix_cart_session_product", "session_id", "product_id"),)
 
 class OrderDB(Base):
     __tablename__ = "orders"
     id = Column(Integer, primary_key=True)
-    items = Column(Text)
+    items = Column(Text)  # копия строк заказа в JSON для быстрой выдачи /orders
     total = Column(Float)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class OrderItemDB(Base):
+    __tablename__ = "order_items"
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), index=True)
+    quantity = Column(Integer)
+    price = Column(Float)  # цена на момент заказа
+
+class IdempotencyKeyDB(Base):
+    """Ответ POST /order, сохраненный по заголовку Idempotency-Key"""
+    __tablename__ = "idempotency_keys"
+    key = Column(String, primary_key=True)  # session_id:Idempotency-Key
+    response = Column(Text)
+    created_at = Column(DateTime, index=True)
+
+class TableVersionDB(Base):
+    """Версия данных таблицы для ETag. Увеличивается в той же транзакции,
+    что и изменение таблицы, поэтому общая для всех процессов-воркеров."""
+    __tablename__ = "table_versions"
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+VERSIONED_TABLES = ("products", "orders")
 
 Base.metadata.create_all(engine)
 
+def migrate_cart(db: Session):
+    """Миграция старых БД: общая корзина -> корзины покупателей.
+    Строки старой общей корзины никому не принадлежат и удаляются."""
+    if "session_id" in [c["name"] for c in inspect(db.connection()).get_columns("cart")]:
+        return
+    db.execute(text("DELETE FROM cart"))
+    db.execute(text("ALTER TABLE cart ADD COLUMN session_id VARCHAR"))
+    db.execute(text("ALTER TABLE cart ADD COLUMN updated_at DATETIME"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS ix_cart_session_product ON cart (session_id, product_id)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS ix_cart_updated_at ON cart (updated_at)"))
+    db.commit()
+
+def migrate_order_items(db: Session):
+    """Миграция старых БД: колонка orders.created_at и перенос строк
+    из JSON-поля orders.items в таблицу order_items"""
+    if "created_at" not in [c["name"] for c in inspect(db.connection()).get_columns("orders")]:
+        db.execute(text("ALTER TABLE orders ADD COLUMN created_at DATETIME"))
+        db.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders (created_at)"))
+    
+    not_migrated = db.query(OrderDB).filter(~exists().where(OrderItemDB.order_id == OrderDB.id))
+    # Цена в старых заказах не сохранялась - берем текущую цену товара
+    prices = dict(db.query(ProductDB.id, ProductDB.price).all())
+    for order in not_migrated:
+        db.add_all([
+            OrderItemDB(
+                order_id=order.id,
+                product_id=item["product_id"],
+                quantity=item["quantity"],
+                price=prices.get(item["product_id"], 0),
+            )
+            for item in json.loads(order.items)
+        ])
+    db.commit()
+
+with SessionLocal() as db:
+    migrate_cart(db)
+    migrate_order_items(db)
+    db.execute(insert(TableVersionDB).prefix_with("OR IGNORE"), [{"name": name, "version": 0} for name in VERSIONED_TABLES])
+    db.commit()
+
 with SessionLocal() as db:
     if not db.query(ProductDB).first():
         db.add_all([
@@ -44,74 +187,433 @@ def get_db():
     with SessionLocal() as db:
         yield db
 
+def get_read_db():
+    with ReadSessionLocal() as db:
+        yield db
+
+def get_session_id(
+    response: Response,
+    x_session_id: Optional[str] = Header(None),
+    session_id: Optional[str] = Cookie(None),
+):
+    """Идентификатор покупателя: заголовок X-Session-Id или cookie session_id.
+    Новому покупателю выдается cookie."""
+    if x_session_id or session_id:
+        return x_session_id or session_id
+    new_session_id = uuid4().hex
+    response.set_cookie("session_id", new_session_id, max_age=CART_TTL, httponly=True)
+    return new_session_id
+
+def cart_of(session_id: str):
+    """Условия отбора строк корзины покупателя, которая еще не истекла"""
+    cutoff = datetime.utcnow() - timedelta(seconds=CART_TTL)
+    return (CartDB.session_id == session_id, CartDB.updated_at >= cutoff)
+
+def expired_carts():
+    """Удаление брошенных корзин (по индексу updated_at)"""
+    cutoff = datetime.utcnow() - timedelta(seconds=CART_TTL)
+    return delete(CartDB).where(or_(CartDB.updated_at < cutoff, CartDB.updated_at.is_(None)))
+
+def load_cart(db: Session, cart):
+    # Корзина вместе с товарами одним запросом (JOIN), без N+1
+    return db.query(CartDB).options(joinedload(CartDB.product)).filter(*cart).all()
+
 class CartItem(BaseModel):
     product_id: int
     quantity: int
 
+PRODUCT_FIELDS = ("id", "name", "price", "stock")
+ORDER_FIELDS = ("id", "items", "total")
+
+def parse_fields(fields: Optional[str], allowed):
+    """Проекция: ?fields=id,name -> список полей для выборки"""
+    if not fields:
+        return list(allowed)
+    # Повтор поля (?fields=id,id) - одно поле: без дублей ключей в JSON
+    # и одной записи кэша на одинаковые проекции
+    names = list(dict.fromkeys(fields.split(",")))
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(400, f"Неизвестные поля: {', '.join(unknown)}")
+    return names
+
+# Строк в одной части потокового ответа (почему не по одной - см. ex-2)
+PAGE_CHUNK = 100
+
+def row_json(row, names, raw_fields):
+    values = (
+        value if name in raw_fields else dumps(value)
+        for name, value in zip(names, row[1:])
+    )
+    return "{" + ",".join(f'"{name}":{value}' for name, value in zip(names, values)) + "}"
+
+def page_chunks(rows, names, raw_fields=()):
+    """Страница списка как JSON-массив частями по PAGE_CHUNK строк.
+
+    rows - кортежи (id, *значения names). Поля из raw_fields уже хранятся
+    как JSON-текст и вставляются в ответ без json.loads/json.dumps.
+    """
+    yield "["
+    for i in range(0, len(rows), PAGE_CHUNK):
+        yield ("," if i else "") + ",".join(row_json(row, names, raw_fields) for row in rows[i:i + PAGE_CHUNK])
+    yield "]"
+
+def page_headers(rows, limit):
+    """Курсор следующей страницы - в заголовке X-Next-Cursor (передать как ?after=)"""
+    return {"X-Next-Cursor": str(rows[-1][0])} if len(rows) == limit else {}
+
+def page_response(rows, names, limit, raw_fields=(), headers=None):
+    """Страница списка потоковым JSON-массивом"""
+    headers = {**(headers or {}), **page_headers(rows, limit)}
+    return StreamingResponse(page_chunks(rows, names, raw_fields), media_type="application/json", headers=headers)
+
+# Условные запросы: ETag - версия таблицы из TableVersionDB, увеличивается
+# в той же транзакции, что и изменение; Cache-Control - как в ex-2
+CACHE_CONTROL = {"products": "public, no-cache", "orders": "private, no-cache"}
+
+def table_version(name):
+    return select(TableVersionDB.version).where(TableVersionDB.name == name)
+
+def bump_versions(*names):
+    return update(TableVersionDB).where(TableVersionDB.name.in_(names)).values(version=TableVersionDB.version + 1)
+
+def cache_headers(table, version):
+    return {"ETag": f'"{table}-{version}"', "Cache-Control": CACHE_CONTROL[table]}
+
+def not_modified(headers, if_none_match: Optional[str]):
+    """Ответ 304, если у клиента уже текущая версия (заголовок If-None-Match)"""
+    if not if_none_match:
+        return None
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if "*" in tags or headers["ETag"] in tags:
+        return Response(status_code=304, headers=headers)
+    return None
+
+def product_page(after, limit, names):
+    """Keyset-пагинация: WHERE id > after ORDER BY id LIMIT limit"""
+    columns = [getattr(ProductDB, name) for name in names]
+    return select(ProductDB.id, *columns).where(ProductDB.id > after).order_by(ProductDB.id).limit(limit)
+
+def order_page(after, limit, names):
+    columns = [getattr(OrderDB, name) for name in names]
+    return select(OrderDB.id, *columns).where(OrderDB.id > after).order_by(OrderDB.id).limit(limit)
+
+# Кэш каталога (read-through): каталог читают намного чаще, чем меняют.
+# Остатки меняет только оформление заказа - после него затронутые товары
+# и все страницы каталога сбрасываются (invalidate_catalog). В каждом
+# процессе-воркере свой кэш, поэтому устаревание ограничено CACHE_TTL.
+page_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+product_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+
+def product_dict(product: ProductDB):
+    return {"id": product.id, "name": product.name, "price": product.price, "stock": product.stock}
+
+def cached_page(key, rows, names, limit, version, headers):
+    """Страница каталога кэшируется уже сериализованной (вместе с ETag) -
+    при попадании не нужны ни запрос к БД, ни json.dumps"""
+    page = ("".join(page_chunks(rows, names)), {**headers, **page_headers(rows, limit)})
+    page_cache.set(key, page, version)
+    return page
+
+def invalidate_catalog(product_ids):
+    page_cache.invalidate()
+    product_cache.invalidate(product_ids)
+
 @app.get("/products")
-def get_products(db: Session = Depends(get_db)):
-    return db.query(ProductDB).all()
+def get_products(
+    limit: int = Query(100, ge=1, le=1000),
+    after: int = 0,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
+):
+    names = parse_fields(fields, PRODUCT_FIELDS)
+    key = (after, limit, tuple(names))
+    page = page_cache.get(key)
+    if page is MISSING:
+        version = page_cache.version
+        # Версию читаем до строк: страница может оказаться новее ETag, но не старее
+        headers = cache_headers("products", db.execute(table_version("products")).scalar_one())
+        if response := not_modified(headers, if_none_match):
+            return response
+        rows = db.execute(product_page(after, limit, names)).all()
+        page = cached_page(key, rows, names, limit, version, headers)
+    body, headers = page
+    return not_modified(headers, if_none_match) or Response(body, media_type="application/json", headers=headers)
 
 @app.get("/products/{product_id}")
-def get_product(product_id: int, db: Session = Depends(get_db)):
-    product = db.query(ProductDB).filter_by(id=product_id).first()
+def get_product(
+    product_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
+):
+    entry = product_cache.get(product_id)
+    if entry is MISSING:
+        version = product_cache.version
+        headers = cache_headers("products", db.execute(table_version("products")).scalar_one())
+        found = db.query(ProductDB).filter_by(id=product_id).first()
+        entry = (product_dict(found) if found else None, headers)
+        product_cache.set(product_id, entry, version)
+    product, headers = entry
     if not product:
         raise HTTPException(404, "Товар не найден")
-    return product
+    response.headers.update(headers)
+    return not_modified(headers, if_none_match) or product
 
 @app.post("/cart")
-def add_to_cart(item: CartItem, db: Session = Depends(get_db)):
+def add_to_cart(item: CartItem, session_id: str = Depends(get_session_id), db: Session = Depends(get_db)):
     product = db.query(ProductDB).filter_by(id=item.product_id).first()
     if not product or product.stock < item.quantity:
         raise HTTPException(400, "Товар недоступен")
     
-    cart_item = db.query(CartDB).filter_by(product_id=item.product_id).first()
-    if cart_item:
-        cart_item.quantity += item.quantity
-    else:
-        db.add(CartDB(product_id=item.product_id, quantity=item.quantity))
+    db.execute(expired_carts())
+    # Увеличиваем количество одним UPDATE, без чтения строки корзины
+    updated = db.query(CartDB).filter_by(session_id=session_id, product_id=item.product_id).update(
+        {CartDB.quantity: CartDB.quantity + item.quantity}
+    )
+    if not updated:
+        db.add(CartDB(session_id=session_id, product_id=item.product_id, quantity=item.quantity, updated_at=datetime.utcnow()))
+    # Продлеваем жизнь всей корзины
+    db.query(CartDB).filter_by(session_id=session_id).update({CartDB.updated_at: datetime.utcnow()})
     db.commit()
     return {"ok": True}
 
+# Пакетное добавление в корзину: POST /cart/batch со списком строк
+MAX_BATCH = 100
+
+def batch_stock(items):
+    """Остатки всех товаров пакета одним SELECT"""
+    return select(ProductDB.id, ProductDB.stock).where(ProductDB.id.in_({item.product_id for item in items}))
+
+def check_batch(items, stock):
+    """Результат по каждой строке и количества к добавлению по товарам
+    (повторы одного товара в пакете суммируются)"""
+    results, accepted = [], {}
+    for item in items:
+        if item.product_id not in stock or stock[item.product_id] < item.quantity:
+            results.append({"product_id": item.product_id, "ok": False, "error": "Товар недоступен"})
+            continue
+        accepted[item.product_id] = accepted.get(item.product_id, 0) + item.quantity
+        results.append({"product_id": item.product_id, "ok": True})
+    return results, accepted
+
+def cart_product_ids(session_id):
+    return select(CartDB.product_id).where(CartDB.session_id == session_id)
+
+# Увеличение количества сразу для многих строк (executemany с параметрами sid, pid, qty)
+cart_table = CartDB.__table__
+increase_cart = (
+    update(cart_table)
+    .where(cart_table.c.session_id == bindparam("sid"), cart_table.c.product_id == bindparam("pid"))
+    .values(quantity=cart_table.c.quantity + bindparam("qty"))
+)
+
+def cart_batch_rows(session_id, accepted, existing):
+    """Параметры executemany: UPDATE для товаров, которые уже в корзине, INSERT для новых"""
+    now = datetime.utcnow()
+    updates = [{"sid": session_id, "pid": pid, "qty": qty} for pid, qty in accepted.items() if pid in existing]
+    inserts = [
+        {"session_id": session_id, "product_id": pid, "quantity": qty, "updated_at": now}
+        for pid, qty in accepted.items() if pid not in existing
+    ]
+    return updates, inserts
+
+@app.post("/cart/batch")
+def add_to_cart_batch(
+    items: List[CartItem] = Body(..., min_length=1, max_length=MAX_BATCH),
+    session_id: str = Depends(get_session_id),
+    db: Session = Depends(get_db),
+):
+    """Несколько строк за один запрос: остатки проверяются одним SELECT,
+    все изменения корзины - одна транзакция"""
+    results, accepted = check_batch(items, dict(db.execute(batch_stock(items)).all()))
+    if accepted:
+        db.execute(expired_carts())
+        existing = set(db.execute(cart_product_ids(session_id)).scalars())
+        updates, inserts = cart_batch_rows(session_id, accepted, existing)
+        if updates:
+            db.execute(increase_cart, updates)
+        if inserts:
+            db.execute(insert(CartDB), inserts)
+        db.query(CartDB).filter_by(session_id=session_id).update({CartDB.updated_at: datetime.utcnow()})
+        db.commit()
+    return {"items": results}
+
 @app.get("/cart")
-def get_cart(db: Session = Depends(get_db)):
+def get_cart(session_id: str = Depends(get_session_id), db: Session = Depends(get_read_db)):
     items = []
     total = 0
-    for cart in db.query(CartDB).all():
-        product = db.query(ProductDB).filter_by(id=cart.product_id).first()
+    for cart in load_cart(db, cart_of(session_id)):
+        product = cart.product
         subtotal = product.price * cart.quantity
         items.append({"product": product.name, "quantity": cart.quantity, "subtotal": subtotal})
         total += subtotal
     return {"items": items, "total": total}
 
-@app.post("/order")
-def create_order(db: Session = Depends(get_db)):
-    cart_items = db.query(CartDB).all()
-    if not cart_items:
-        raise HTTPException(400, "Корзина пуста")
-    
-    total = 0
-    items = []
-    for item in cart_items:
-        product = db.query(ProductDB).filter_by(id=item.product_id).first()
-        if product.stock < item.quantity:
+def with_retry(action, attempts=5, delay=0.05):
+    """Повторить транзакцию, если SQLite ответил 'database is locked'"""
+    for attempt in range(attempts):
+        try:
+            return action()
+        except OperationalError as e:
+            if "database is locked" not in str(e) or attempt == attempts - 1:
+                raise
+            time.sleep(delay * 2 ** attempt)
+
+def reserve_stock(cart):
+    """Атомарное списание всей корзины одним UPDATE: остаток проверяется
+    в WHERE, поэтому параллельные заказы не уводят его в минус"""
+    quantity = (
+        select(CartDB.quantity)
+        .where(CartDB.product_id == ProductDB.id, *cart)
+        .scalar_subquery()
+    )
+    return (
+        update(ProductDB)
+        .where(ProductDB.id.in_(select(CartDB.product_id).where(*cart)), ProductDB.stock >= quantity)
+        .values(stock=ProductDB.stock - quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+def build_order(cart_items):
+    """Заказ из загруженной корзины"""
+    items = [{"product_id": item.product_id, "quantity": item.quantity} for item in cart_items]
+    total = sum(item.product.price * item.quantity for item in cart_items)
+    return OrderDB(items=json.dumps(items), total=total)
+
+def order_lines(order_id, cart_items):
+    """Строки order_items для вставки одним executemany"""
+    return [
+        {"order_id": order_id, "product_id": item.product_id, "quantity": item.quantity, "price": item.product.price}
+        for item in cart_items
+    ]
+
+# Идемпотентность заказа: ответ сохраняется в той же транзакции, что и заказ,
+# поэтому повтор запроса с тем же Idempotency-Key (например, после таймаута)
+# получает исходный ответ и не создает второй заказ
+def idempotency_scope(session_id: str, idempotency_key: Optional[str]):
+    """Ключи разных покупателей не пересекаются"""
+    return f"{session_id}:{idempotency_key}" if idempotency_key else None
+
+def stored_response(key):
+    cutoff = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL)
+    return select(IdempotencyKeyDB.response).where(IdempotencyKeyDB.key == key, IdempotencyKeyDB.created_at >= cutoff)
+
+def expired_idempotency_keys():
+    cutoff = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL)
+    return delete(IdempotencyKeyDB).where(IdempotencyKeyDB.created_at < cutoff)
+
+def place_order(db: Session, session_id: str, idempotency_key: Optional[str] = None):
+    """Оформить заказ; возвращает (ответ, был ли он взят из сохраненных)"""
+    cart = cart_of(session_id)
+    try:
+        updated = db.execute(reserve_stock(cart)).rowcount
+        
+        # Ключ проверяем уже под блокировкой записи: параллельный повтор
+        # дождется commit первого запроса и увидит его ответ
+        if idempotency_key:
+            stored = db.execute(stored_response(idempotency_key)).scalar()
+            if stored:
+                db.rollback()
+                return json.loads(stored), True
+        
+        # Корзину читаем уже внутри транзакции записи - она не изменится до commit
+        cart_items = load_cart(db, cart)
+        if not cart_items:
+            raise HTTPException(400, "Корзина пуста")
+        if updated != len(cart_items):
             raise HTTPException(400, "Недостаточно товара")
-        total += product.price * item.quantity
-        items.append({"product_id": item.product_id, "quantity": item.quantity})
-        product.stock -= item.quantity
-    
-    order = OrderDB(items=json.dumps(items), total=total)
-    db.add(order)
-    db.query(CartDB).delete()
-    db.commit()
-    return {"order_id": order.id, "total": total}
+        
+        order = build_order(cart_items)
+        db.add(order)
+        db.flush()
+        db.execute(insert(OrderItemDB), order_lines(order.id, cart_items))
+        db.query(CartDB).filter_by(session_id=session_id).delete()
+        db.execute(bump_versions(*VERSIONED_TABLES))
+        result = {"order_id": order.id, "total": order.total}
+        if idempotency_key:
+            db.execute(expired_idempotency_keys())
+            db.add(IdempotencyKeyDB(key=idempotency_key, response=json.dumps(result), created_at=datetime.utcnow()))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    invalidate_catalog([item.product_id for item in cart_items])
+    return result, False
+
+@app.post("/order")
+def create_order(
+    response: Response,
+    session_id: str = Depends(get_session_id),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    db: Session = Depends(get_db),
+):
+    key = idempotency_scope(session_id, idempotency_key)
+    result, replayed = with_retry(lambda: place_order(db, session_id, key))
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
 
 @app.get("/orders")
-def get_orders(db: Session = Depends(get_db)):
-    return [{"id": o.id, "items": json.loads(o.items), "total": o.total} for o in db.query(OrderDB).all()]
+def get_orders(
+    limit: int = Query(100, ge=1, le=1000),
+    after: int = 0,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_read_db),
+):
+    names = parse_fields(fields, ORDER_FIELDS)
+    headers = cache_headers("orders", db.execute(table_version("orders")).scalar_one())
+    if response := not_modified(headers, if_none_match):
+        return response
+    rows = db.execute(order_page(after, limit, names)).all()
+    return page_response(rows, names, limit, raw_fields=("items",), headers=headers)
+
+def top_products_query(limit):
+    """Самые продаваемые товары: количество и выручка по order_items"""
+    quantity = func.sum(OrderItemDB.quantity).label("quantity")
+    revenue = func.sum(OrderItemDB.quantity * OrderItemDB.price).label("revenue")
+    return (
+        select(OrderItemDB.product_id, ProductDB.name, quantity, revenue)
+        .join(ProductDB, ProductDB.id == OrderItemDB.product_id)
+        .group_by(OrderItemDB.product_id, ProductDB.name)
+        .order_by(quantity.desc())
+        .limit(limit)
+    )
+
+def revenue_query(date_from, date_to):
+    """Выручка и число заказов за период (границы включительно)"""
+    query = select(
+        func.count(func.distinct(OrderDB.id)),
+        func.coalesce(func.sum(OrderItemDB.quantity * OrderItemDB.price), 0),
+    ).join(OrderItemDB, OrderItemDB.order_id == OrderDB.id)
+    if date_from:
+        query = query.where(OrderDB.created_at >= date_from)
+    if date_to:
+        query = query.where(OrderDB.created_at <= date_to)
+    return query
+
+@app.get("/reports/top-products")
+def get_top_products(limit: int = Query(10, ge=1, le=100), db: Session = Depends(get_read_db)):
+    rows = db.execute(top_products_query(limit)).all()
+    return [dict(row._mapping) for row in rows]
+
+@app.get("/reports/revenue")
+def get_revenue(
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    db: Session = Depends(get_read_db),
+):
+    orders, revenue = db.execute(revenue_query(date_from, date_to)).one()
+    return {"from": date_from, "to": date_to, "orders": orders, "revenue": revenue}
+
+@app.get("/stats/cache")
+def get_cache_stats():
+    return {"products": page_cache.stats(), "product": product_cache.stats()}
 
 @app.delete("/cart/{product_id}")
-def remove_from_cart(product_id: int, db: Session = Depends(get_db)):
-    db.query(CartDB).filter_by(product_id=product_id).delete()
+def remove_from_cart(product_id: int, session_id: str = Depends(get_session_id), db: Session = Depends(get_db)):
+    db.query(CartDB).filter_by(session_id=session_id, product_id=product_id).delete()
     db.commit()
     return {"ok": True}
\ No newline at end of file
@@ -0,0 +1,258 @@
+"""Асинхронный вариант SQLite-магазина: AsyncSession + aiosqlite.
+
+Те же модели, настройки и маршруты, что и в shop.py, но обработчики - async def
+и не занимают потоки threadpool, пока ждут БД.
+"""
+import asyncio
+import json
+
+from fastapi import FastAPI, HTTPException, Depends, Query, Header, Body, Response
+from typing import List, Optional
+from datetime import datetime
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import joinedload
+
+# Схема, начальные данные и профили движка - общие с синхронной версией
+from shop import DB_URL, profile, attach_pragmas, count_queries, reserve_stock, ProductDB, CartDB, OrderItemDB, CartItem
+from shop import IdempotencyKeyDB, idempotency_scope, stored_response, expired_idempotency_keys
+from shop import VERSIONED_TABLES, table_version, bump_versions, cache_headers, not_modified
+from shop import PRODUCT_FIELDS, ORDER_FIELDS, parse_fields, page_response, product_page, order_page
+from shop import build_order, order_lines, top_products_query, revenue_query
+from shop import get_session_id, cart_of, expired_carts
+from shop import MAX_BATCH, batch_stock, check_batch, cart_product_ids, increase_cart, cart_batch_rows
+from shop import MISSING, page_cache, product_cache, product_dict, cached_page, invalidate_catalog
+from metrics import MetricsMiddleware, metrics_endpoint
+
+app = FastAPI(title="Shop API (async)")
+# Время, коды ответов и обращения к БД по маршрутам - GET /metrics (формат Prometheus)
+app.add_middleware(MetricsMiddleware, backends=("sql",))
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+ASYNC_DB_URL = DB_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+def make_async_engine(pragmas, read_only=False, **pool):
+    new_engine = create_async_engine(ASYNC_DB_URL, **pool)
+    attach_pragmas(new_engine.sync_engine, pragmas, read_only)
+    count_queries(new_engine.sync_engine)
+    return new_engine
+
+engine = make_async_engine(profile["pragmas"], **profile["writer_pool"])
+if profile["reader_pool"] is None:
+    read_engine = engine
+else:
+    read_engine = make_async_engine(profile["pragmas"], read_only=True, **profile["reader_pool"])
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(read_engine, expire_on_commit=False)
+
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+async def get_read_db():
+    async with ReadSessionLocal() as db:
+        yield db
+
+async def load_cart(db: AsyncSession, cart):
+    # Корзина вместе с товарами одним запросом (JOIN), без N+1
+    result = await db.execute(select(CartDB).options(joinedload(CartDB.product)).where(*cart))
+    return result.scalars().all()
+
+@app.get("/products")
+async def get_products(
+    limit: int = Query(100, ge=1, le=1000),
+    after: int = 0,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    names = parse_fields(fields, PRODUCT_FIELDS)
+    key = (after, limit, tuple(names))
+    page = page_cache.get(key)
+    if page is MISSING:
+        version = page_cache.version
+        # Версию читаем до строк: страница может оказаться новее ETag, но не старее
+        headers = cache_headers("products", (await db.execute(table_version("products"))).scalar_one())
+        if response := not_modified(headers, if_none_match):
+            return response
+        rows = (await db.execute(product_page(after, limit, names))).all()
+        page = cached_page(key, rows, names, limit, version, headers)
+    body, headers = page
+    return not_modified(headers, if_none_match) or Response(body, media_type="application/json", headers=headers)
+
+@app.get("/products/{product_id}")
+async def get_product(
+    product_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    entry = product_cache.get(product_id)
+    if entry is MISSING:
+        version = product_cache.version
+        headers = cache_headers("products", (await db.execute(table_version("products"))).scalar_one())
+        found = await db.get(ProductDB, product_id)
+        entry = (product_dict(found) if found else None, headers)
+        product_cache.set(product_id, entry, version)
+    product, headers = entry
+    if not product:
+        raise HTTPException(404, "Товар не найден")
+    response.headers.update(headers)
+    return not_modified(headers, if_none_match) or product
+
+@app.post("/cart")
+async def add_to_cart(item: CartItem, session_id: str = Depends(get_session_id), db: AsyncSession = Depends(get_db)):
+    product = await db.get(ProductDB, item.product_id)
+    if not product or product.stock < item.quantity:
+        raise HTTPException(400, "Товар недоступен")
+
+    await db.execute(expired_carts())
+    # Увеличиваем количество одним UPDATE, без чтения строки корзины
+    result = await db.execute(
+        update(CartDB)
+        .where(CartDB.session_id == session_id, CartDB.product_id == item.product_id)
+        .values(quantity=CartDB.quantity + item.quantity)
+    )
+    if not result.rowcount:
+        db.add(CartDB(session_id=session_id, product_id=item.product_id, quantity=item.quantity, updated_at=datetime.utcnow()))
+    # Продлеваем жизнь всей корзины
+    await db.execute(update(CartDB).where(CartDB.session_id == session_id).values(updated_at=datetime.utcnow()))
+    await db.commit()
+    return {"ok": True}
+
+@app.post("/cart/batch")
+async def add_to_cart_batch(
+    items: List[CartItem] = Body(..., min_length=1, max_length=MAX_BATCH),
+    session_id: str = Depends(get_session_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """Несколько строк за один запрос: остатки проверяются одним SELECT,
+    все изменения корзины - одна транзакция"""
+    results, accepted = check_batch(items, dict((await db.execute(batch_stock(items))).all()))
+    if accepted:
+        await db.execute(expired_carts())
+        existing = set((await db.execute(cart_product_ids(session_id))).scalars())
+        updates, inserts = cart_batch_rows(session_id, accepted, existing)
+        if updates:
+            await db.execute(increase_cart, updates)
+        if inserts:
+            await db.execute(insert(CartDB), inserts)
+        await db.execute(update(CartDB).where(CartDB.session_id == session_id).values(updated_at=datetime.utcnow()))
+        await db.commit()
+    return {"items": results}
+
+@app.get("/cart")
+async def get_cart(session_id: str = Depends(get_session_id), db: AsyncSession = Depends(get_read_db)):
+    items = []
+    total = 0
+    for cart in await load_cart(db, cart_of(session_id)):
+        product = cart.product
+        subtotal = product.price * cart.quantity
+        items.append({"product": product.name, "quantity": cart.quantity, "subtotal": subtotal})
+        total += subtotal
+    return {"items": items, "total": total}
+
+async def with_retry(action, attempts=5, delay=0.05):
+    """Повторить транзакцию, если SQLite ответил 'database is locked'"""
+    for attempt in range(attempts):
+        try:
+            return await action()
+        except OperationalError as e:
+            if "database is locked" not in str(e) or attempt == attempts - 1:
+                raise
+            await asyncio.sleep(delay * 2 ** attempt)
+
+async def place_order(db: AsyncSession, session_id: str, idempotency_key: Optional[str] = None):
+    """Оформить заказ; возвращает (ответ, был ли он взят из сохраненных)"""
+    cart = cart_of(session_id)
+    try:
+        updated = (await db.execute(reserve_stock(cart))).rowcount
+        
+        # Ключ проверяем уже под блокировкой записи: параллельный повтор
+        # дождется commit первого запроса и увидит его ответ
+        if idempotency_key:
+            stored = (await db.execute(stored_response(idempotency_key))).scalar()
+            if stored:
+                await db.rollback()
+                return json.loads(stored), True
+
+        # Корзину читаем уже внутри транзакции записи - она не изменится до commit
+        cart_items = await load_cart(db, cart)
+        if not cart_items:
+            raise HTTPException(400, "Корзина пуста")
+        if updated != len(cart_items):
+            raise HTTPException(400, "Недостаточно товара")
+
+        order = build_order(cart_items)
+        db.add(order)
+        await db.flush()
+        await db.execute(insert(OrderItemDB), order_lines(order.id, cart_items))
+        await db.execute(delete(CartDB).where(CartDB.session_id == session_id))
+        await db.execute(bump_versions(*VERSIONED_TABLES))
+        result = {"order_id": order.id, "total": order.total}
+        if idempotency_key:
+            await db.execute(expired_idempotency_keys())
+            db.add(IdempotencyKeyDB(key=idempotency_key, response=json.dumps(result), created_at=datetime.utcnow()))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    invalidate_catalog([item.product_id for item in cart_items])
+    return result, False
+
+@app.post("/order")
+async def create_order(
+    response: Response,
+    session_id: str = Depends(get_session_id),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    db: AsyncSession = Depends(get_db),
+):
+    key = idempotency_scope(session_id, idempotency_key)
+    result, replayed = await with_retry(lambda: place_order(db, session_id, key))
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+@app.get("/orders")
+async def get_orders(
+    limit: int = Query(100, ge=1, le=1000),
+    after: int = 0,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    names = parse_fields(fields, ORDER_FIELDS)
+    headers = cache_headers("orders", (await db.execute(table_version("orders"))).scalar_one())
+    if response := not_modified(headers, if_none_match):
+        return response
+    rows = (await db.execute(order_page(after, limit, names))).all()
+    return page_response(rows, names, limit, raw_fields=("items",), headers=headers)
+
+@app.get("/reports/top-products")
+async def get_top_products(limit: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_read_db)):
+    rows = (await db.execute(top_products_query(limit))).all()
+    return [dict(row._mapping) for row in rows]
+
+@app.get("/reports/revenue")
+async def get_revenue(
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    orders, revenue = (await db.execute(revenue_query(date_from, date_to))).one()
+    return {"from": date_from, "to": date_to, "orders": orders, "revenue": revenue}
+
+@app.get("/stats/cache")
+async def get_cache_stats():
+    return {"products": page_cache.stats(), "product": product_cache.stats()}
+
+@app.delete("/cart/{product_id}")
+async def remove_from_cart(product_id: int, session_id: str = Depends(get_session_id), db: AsyncSession = Depends(get_db)):
+    await db.execute(delete(CartDB).where(CartDB.session_id == session_id, CartDB.product_id == product_id))
+    await db.commit()
+    return {"ok": True}
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=8002)
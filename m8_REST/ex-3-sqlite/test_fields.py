@@ -0,0 +1,36 @@
+"""Проверки проекции ?fields= (parse_fields) в shop.py и shop_async.py.
+
+Запуск: python -m pytest test_fields.py (или python test_fields.py)
+Использует временную БД, shop.db не трогает.
+"""
+import os
+import tempfile
+
+if "SHOP_DB_URL" not in os.environ:
+    os.environ["SHOP_DB_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
+
+from fastapi.testclient import TestClient
+
+import shop
+import shop_async
+
+def test_parse_fields_dedupes():
+    assert shop.parse_fields("id,name,id", shop.PRODUCT_FIELDS) == ["id", "name"]
+
+def test_repeated_field_selected_once():
+    for app in (shop.app, shop_async.app):
+        with TestClient(app) as client:
+            shop.page_cache.invalidate()
+            response = client.get("/products?limit=1&fields=id,name,id")
+            assert response.status_code == 200
+            assert response.text.count('"id"') == 1
+            assert list(response.json()[0]) == ["id", "name"]
+            # Одинаковые проекции - одна запись кэша каталога
+            hits = shop.page_cache.hits
+            assert client.get("/products?limit=1&fields=id,name").text == response.text
+            assert shop.page_cache.hits == hits + 1
+
+if __name__ == "__main__":
+    test_parse_fields_dedupes()
+    test_repeated_field_selected_once()
+    print("OK")
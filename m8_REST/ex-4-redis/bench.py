@@ -0,0 +1,112 @@
+"""Бенчмарки Redis-магазина.
+
+Запуск: python bench.py
+Если локальный Redis недоступен, используется fakeredis (pip install fakeredis).
+ВНИМАНИЕ: с настоящим Redis бенчмарк перезаписывает ключи магазина.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+import json
+import time
+
+import os
+
+import redis
+import redis.asyncio
+
+try:
+    redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379")).ping()
+except redis.ConnectionError:
+    import fakeredis
+    from fakeredis.aioredis import FakeConnection
+
+    # Тот же пул соединений магазина, но соединения - с in-process fakeredis
+    server = fakeredis.FakeServer()
+
+    class FakeBlockingConnectionPool(redis.asyncio.BlockingConnectionPool):
+        @classmethod
+        def from_url(cls, url, **kwargs):
+            return cls(connection_class=FakeConnection, server=server, **kwargs)
+
+    redis.asyncio.BlockingConnectionPool = FakeBlockingConnectionPool
+    print("Локальный Redis недоступен - используется fakeredis")
+
+from fastapi.testclient import TestClient
+
+import shop
+
+# Через with: один event loop на все запросы (соединения пула привязаны к нему)
+# и запуск lifespan (миграция и начальные данные)
+client = TestClient(shop.app).__enter__()
+
+def order_worker(attempts):
+    """Покупатель: кладет товар 1 в свою корзину и оформляет заказ"""
+    headers = {"X-Session-Id": uuid4().hex}
+    statuses = {}
+    for _ in range(attempts):
+        client.post("/cart", json={"product_id": 1, "quantity": 1}, headers=headers)
+        status = client.post("/order", headers=headers).status_code
+        statuses[status] = statuses.get(status, 0) + 1
+    return statuses
+
+def bench_oversell(workers=16, stock=50, attempts=20):
+    """Параллельные заказы одного товара не уводят остаток в минус"""
+    run(shop.r.hset(shop.product_key(1), "stock", stock))
+    run(shop.r.delete("orders", "orders:ids"))
+
+    with ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(order_worker, [attempts] * workers))
+
+    left = int(run(shop.r.hget(shop.product_key(1), "stock")))
+    sold = sum(
+        item["quantity"]
+        for order in run(shop.r.hvals("orders"))
+        for item in json.loads(order)["items"]
+        if item["product_id"] == 1
+    )
+    statuses = {}
+    for result in results:
+        for status, count in result.items():
+            statuses[status] = statuses.get(status, 0) + count
+    print(f"Потоков: {workers}, ответы: {statuses}")
+    print(f"Остаток: {left}, продано: {sold}, перепродано: {max(0, sold - stock)}")
+    assert left >= 0 and sold + left == stock
+
+def run(coroutine):
+    """Выполнить команду Redis в event loop клиента"""
+    return client.portal.call(lambda: coroutine)
+
+async def ops_per_second(operation, seconds=1.0):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        await operation()
+        count += 1
+    return count / seconds
+
+def bench_stock_update():
+    """Изменение остатка: JSON-строка в общем hash против поля hash товара"""
+    product = {"name": "Телефон", "price": 50000, "stock": 10**9}
+    run(shop.r.hset("bench:products", "1", json.dumps(product)))
+    run(shop.r.hset("bench:product:1", mapping=product))
+
+    async def json_update():
+        # Старая схема: GET -> json.loads -> изменение -> json.dumps -> SET
+        data = json.loads(await shop.r.hget("bench:products", "1"))
+        data["stock"] -= 1
+        await shop.r.hset("bench:products", "1", json.dumps(data))
+
+    async def hash_update():
+        await shop.r.hincrby("bench:product:1", "stock", -1)
+
+    before = run(ops_per_second(json_update))
+    after = run(ops_per_second(hash_update))
+    run(shop.r.delete("bench:products", "bench:product:1"))
+    print("Изменение остатка, оп/с")
+    print(f"JSON в hash products: {before:8.0f}")
+    print(f"HINCRBY product:{{id}}: {after:8.0f}")
+
+if __name__ == "__main__":
+    bench_oversell()
+    bench_stock_update()
+    client.__exit__(None, None, None)
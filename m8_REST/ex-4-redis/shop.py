@@ -1,62 +1,258 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Depends, Header, Cookie, Body, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
+from uuid import uuid4
 import redis
+import redis.asyncio
+from fast_json import dumps
+from metrics import MetricsMiddleware, metrics_endpoint, count_call
 import json
+import os
 
-app = FastAPI(title="Shop Redis API")
-r = redis.Redis(host='localhost', port=6379, decode_responses=True)
+# Настройки подключения (переменные окружения)
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+CART_TTL = int(os.getenv("SHOP_CART_TTL", "1800"))  # секунд бездействия до удаления корзины
+IDEMPOTENCY_TTL = int(os.getenv("SHOP_IDEMPOTENCY_TTL", "86400"))  # сколько секунд помнить Idempotency-Key
 
-# Инициализация данных
-if not r.exists("products"):
-    products = {
-        "1": {"name": "Телефон", "price": 50000, "stock": 10},
-        "2": {"name": "Ноутбук", "price": 80000, "stock": 5},
-        "3": {"name": "Наушники", "price": 5000, "stock": 20}
-    }
-    r.hset("products", mapping={k: json.dumps(v) for k, v in products.items()})
+class MeteredPool(redis.asyncio.BlockingConnectionPool):
+    """Соединение берется из пула на каждую команду, конвейер или вызов
+    скрипта, т.е. на каждый round-trip - их и считаем в метриках запроса"""
+    async def get_connection(self, *args, **kwargs):
+        count_call("redis")
+        return await super().get_connection(*args, **kwargs)
+
+# Пул фиксированного размера: при исчерпании запрос ждет свободное соединение
+# (до REDIS_POOL_TIMEOUT секунд), а не открывает новое
+pool = MeteredPool.from_url(
+    REDIS_URL,
+    max_connections=REDIS_POOL_SIZE,
+    timeout=REDIS_POOL_TIMEOUT,
+    decode_responses=True,
+)
+r = redis.asyncio.Redis(connection_pool=pool)
+
+# Товары хранятся отдельными hash: product:{id} -> name, price, stock,
+# поэтому остаток меняется одной командой HINCRBY без разбора JSON
+def product_key(product_id):
+    return f"product:{product_id}"
+
+async def migrate_products():
+    """Миграция со старой схемы: JSON-строки в общем hash products"""
+    old_products = await r.hgetall("products")
+    if not old_products:
+        return
+    pipe = r.pipeline()
+    for product_id, value in old_products.items():
+        pipe.hset(product_key(product_id), mapping=json.loads(value))
+        pipe.zadd("products:ids", {product_id: int(product_id)})
+    pipe.delete("products")
+    await pipe.execute()
+
+async def init_data():
+    """Начальные товары и индекс id заказов для keyset-пагинации"""
+    if not await r.exists("products:ids"):
+        products = {
+            "1": {"name": "Телефон", "price": 50000, "stock": 10},
+            "2": {"name": "Ноутбук", "price": 80000, "stock": 5},
+            "3": {"name": "Наушники", "price": 5000, "stock": 20}
+        }
+        pipe = r.pipeline()
+        for product_id, product in products.items():
+            pipe.hset(product_key(product_id), mapping=product)
+            pipe.zadd("products:ids", {product_id: int(product_id)})
+        await pipe.execute()
+    
+    if not await r.exists("orders:ids") and await r.exists("orders"):
+        await r.zadd("orders:ids", {key: int(key) for key in await r.hkeys("orders")})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await migrate_products()
+    await init_data()
+    yield
+    await r.aclose()
+    await pool.disconnect()
+
+app = FastAPI(title="Shop Redis API", lifespan=lifespan)
+# Время, коды ответов и обращения к Redis по маршрутам - GET /metrics (формат Prometheus)
+app.add_middleware(MetricsMiddleware, backends=("redis",))
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+def parse_product(product_id, data):
+    """Поля hash товара приходят строками - приводим типы"""
+    return {"id": int(product_id), "name": data["name"], "price": float(data["price"]), "stock": int(data["stock"])}
+
+# Корзина покупателя - отдельный hash cart:{session_id} со сроком жизни CART_TTL,
+# брошенные корзины Redis удаляет сам
+def get_session_id(
+    response: Response,
+    x_session_id: Optional[str] = Header(None),
+    session_id: Optional[str] = Cookie(None),
+):
+    """Идентификатор покупателя: заголовок X-Session-Id или cookie session_id.
+    Новому покупателю выдается cookie."""
+    if x_session_id or session_id:
+        return x_session_id or session_id
+    new_session_id = uuid4().hex
+    response.set_cookie("session_id", new_session_id, max_age=CART_TTL, httponly=True)
+    return new_session_id
+
+def cart_key(session_id: str = Depends(get_session_id)):
+    return f"cart:{session_id}"
 
 class CartItem(BaseModel):
     product_id: int
     quantity: int
 
+PRODUCT_FIELDS = ("id", "name", "price", "stock")
+ORDER_FIELDS = ("id", "items", "total")
+
+def parse_fields(fields: Optional[str], allowed):
+    """Проекция: ?fields=id,name -> список полей"""
+    if not fields:
+        return list(allowed)
+    # Повтор поля (?fields=id,id) - одно поле: без дублей ключей в JSON
+    # и одной записи кэша на одинаковые проекции
+    names = list(dict.fromkeys(fields.split(",")))
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise HTTPException(400, f"Неизвестные поля: {', '.join(unknown)}")
+    return names
+
+async def page_ids(index, after: int, limit: int):
+    """Keyset-пагинация: id > after из отсортированного множества"""
+    return await r.zrangebyscore(index, f"({after}", "+inf", start=0, num=limit)
+
+# Условные запросы: версии данных для ETag хранятся в hash versions
+# (products, orders) и увеличиваются скриптом оформления заказа;
+# Cache-Control - как в ex-2
+CACHE_CONTROL = {"products": "public, no-cache", "orders": "private, no-cache"}
+
+async def cache_headers(table):
+    """Заголовки ETag и Cache-Control для текущей версии table"""
+    version = await r.hget("versions", table) or 0
+    return {"ETag": f'"{table}-{version}"', "Cache-Control": CACHE_CONTROL[table]}
+
+def not_modified(headers, if_none_match: Optional[str]):
+    """Ответ 304, если у клиента уже текущая версия (заголовок If-None-Match)"""
+    if not if_none_match:
+        return None
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if "*" in tags or headers["ETag"] in tags:
+        return Response(status_code=304, headers=headers)
+    return None
+
+# Документов в одной части потокового ответа (почему не по одному - см. ex-2)
+PAGE_CHUNK = 100
+
+def page_response(ids, documents, limit, headers):
+    """Страница списка потоковым JSON-массивом из готовых JSON-строк
+    (частями по PAGE_CHUNK документов).
+    Курсор следующей страницы - в заголовке X-Next-Cursor (передать как ?after=)."""
+    def chunks():
+        yield "["
+        for i in range(0, len(documents), PAGE_CHUNK):
+            yield ("," if i else "") + ",".join(documents[i:i + PAGE_CHUNK])
+        yield "]"
+    
+    if len(ids) == limit:
+        headers = {**headers, "X-Next-Cursor": ids[-1]}
+    return StreamingResponse(chunks(), media_type="application/json", headers=headers)
+
 @app.get("/products")
-def get_products():
-    products = r.hgetall("products")
-    return [{"id": int(k), **json.loads(v)} for k, v in products.items()]
+async def get_products(
+    limit: int = Query(100, ge=1, le=1000),
+    after: int = 0,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    names = parse_fields(fields, PRODUCT_FIELDS)
+    # Версию читаем до данных: страница может оказаться новее ETag, но не старее
+    headers = await cache_headers("products")
+    if response := not_modified(headers, if_none_match):
+        return response
+    ids = await page_ids("products:ids", after, limit)
+    pipe = r.pipeline(transaction=False)
+    for product_id in ids:
+        pipe.hgetall(product_key(product_id))
+    documents = []
+    for product_id, data in zip(ids, await pipe.execute()):
+        product = parse_product(product_id, data)
+        documents.append(dumps({name: product[name] for name in names}))
+    return page_response(ids, documents, limit, headers)
 
 @app.get("/products/{product_id}")
-def get_product(product_id: int):
-    product = r.hget("products", str(product_id))
+async def get_product(product_id: int, response: Response, if_none_match: Optional[str] = Header(None)):
+    headers = await cache_headers("products")
+    product = await r.hgetall(product_key(product_id))
     if not product:
         raise HTTPException(404, "Товар не найден")
-    return {"id": product_id, **json.loads(product)}
+    response.headers.update(headers)
+    return not_modified(headers, if_none_match) or parse_product(product_id, product)
 
 @app.post("/cart")
-def add_to_cart(item: CartItem):
-    product = r.hget("products", str(item.product_id))
-    if not product:
+async def add_to_cart(item: CartItem, cart: str = Depends(cart_key)):
+    stock = await r.hget(product_key(item.product_id), "stock")
+    if stock is None:
         raise HTTPException(404, "Товар не найден")
     
-    product_data = json.loads(product)
-    if product_data["stock"] < item.quantity:
+    if int(stock) < item.quantity:
         raise HTTPException(400, "Недостаточно товара")
     
-    current = r.hget("cart", str(item.product_id))
-    quantity = item.quantity + (int(current) if current else 0)
-    r.hset("cart", str(item.product_id), quantity)
+    pipe = r.pipeline()
+    pipe.hincrby(cart, str(item.product_id), item.quantity)
+    pipe.expire(cart, CART_TTL)
+    await pipe.execute()
     return {"ok": True}
 
+MAX_BATCH = 100
+
+@app.post("/cart/batch")
+async def add_to_cart_batch(
+    items: List[CartItem] = Body(..., min_length=1, max_length=MAX_BATCH),
+    cart: str = Depends(cart_key),
+):
+    """Несколько строк за один запрос: остатки читаются одним pipeline,
+    принятые строки записываются вторым (MULTI/EXEC); в ответе - результат
+    по каждой строке"""
+    reads = r.pipeline(transaction=False)
+    for item in items:
+        reads.hget(product_key(item.product_id), "stock")
+    
+    results = []
+    pipe = r.pipeline()
+    for item, stock in zip(items, await reads.execute()):
+        if stock is None:
+            results.append({"product_id": item.product_id, "ok": False, "error": "Товар не найден"})
+        elif int(stock) < item.quantity:
+            results.append({"product_id": item.product_id, "ok": False, "error": "Недостаточно товара"})
+        else:
+            pipe.hincrby(cart, str(item.product_id), item.quantity)
+            results.append({"product_id": item.product_id, "ok": True})
+    
+    if len(pipe):
+        pipe.expire(cart, CART_TTL)
+        await pipe.execute()
+    return {"items": results}
+
 @app.get("/cart")
-def get_cart():
-    cart = r.hgetall("cart")
+async def get_cart(cart_id: str = Depends(cart_key)):
+    cart = await r.hgetall(cart_id)
     items = []
     total = 0
     
-    for product_id, quantity in cart.items():
-        product = json.loads(r.hget("products", product_id))
-        subtotal = product["price"] * int(quantity)
+    pipe = r.pipeline(transaction=False)
+    for product_id in cart:
+        pipe.hmget(product_key(product_id), "name", "price")
+    
+    for (product_id, quantity), (name, price) in zip(cart.items(), await pipe.execute()):
+        subtotal = float(price) * int(quantity)
         items.append({
-            "product": product["name"],
+            "product": name,
             "quantity": int(quantity),
             "subtotal": subtotal
         })
@@ -64,45 +260,127 @@ def get_cart():
     
     return {"items": items, "total": total}
 
+# Оформление заказа целиком на стороне Redis: скрипт выполняется атомарно,
+# поэтому два параллельных заказа не могут оба пройти проверку остатка.
+# Все ключи, которые трогает скрипт, передаются в KEYS (этого требуют
+# Redis Cluster и проверка доступа скриптов к ключам), поэтому ключи товаров
+# корзины клиент узнает заранее (HKEYS). Если корзина успела измениться и в
+# ней товар без переданного ключа, скрипт ничего не меняет и отвечает RETRY.
+# KEYS: корзина, order_counter, orders, orders:ids, versions, ключи товаров
+#       из ARGV и последним - ключ идемпотентности, если ARGV[2] == "1".
+# ARGV: TTL ключа идемпотентности (секунд), "1"/"0" - есть ли он, id товаров.
+# Возвращает {заказ в JSON, 1 - ответ взят из сохраненного по ключу / 0 - новый заказ}
+CHECKOUT_LUA = """
+local count = #ARGV - 2
+local idempotency_key = ARGV[2] == '1' and KEYS[6 + count] or nil
+if idempotency_key then
+    local stored = redis.call('GET', idempotency_key)
+    if stored then
+        return {stored, 1}
+    end
+end
+
+local cart = redis.call('HGETALL', KEYS[1])
+if #cart == 0 then
+    return redis.error_reply('EMPTY')
+end
+
+local product_keys = {}
+for i = 1, count do
+    product_keys[ARGV[2 + i]] = KEYS[5 + i]
+end
+
+local items = {}
+local total = 0
+for i = 1, #cart, 2 do
+    local product_id, qty = cart[i], tonumber(cart[i + 1])
+    local key = product_keys[product_id]
+    if not key then
+        return redis.error_reply('RETRY')
+    end
+    local product = redis.call('HMGET', key, 'price', 'stock')
+    if not product[2] or tonumber(product[2]) < qty then
+        return redis.error_reply('STOCK')
+    end
+    total = total + tonumber(product[1]) * qty
+    items[#items + 1] = {product_id = tonumber(product_id), quantity = qty, key = key}
+end
+
+for _, item in ipairs(items) do
+    redis.call('HINCRBY', item.key, 'stock', -item.quantity)
+    item.key = nil
+end
+local order_id = redis.call('INCR', KEYS[2])
+local order = cjson.encode({id = order_id, items = items, total = total})
+redis.call('HSET', KEYS[3], order_id, order)
+redis.call('ZADD', KEYS[4], order_id, order_id)
+redis.call('DEL', KEYS[1])
+redis.call('HINCRBY', KEYS[5], 'products', 1)
+redis.call('HINCRBY', KEYS[5], 'orders', 1)
+if idempotency_key then
+    redis.call('SET', idempotency_key, order, 'EX', ARGV[1])
+end
+return {order, 0}
+"""
+checkout = r.register_script(CHECKOUT_LUA)
+
+CHECKOUT_ERRORS = {
+    "EMPTY": "Корзина пуста",
+    "STOCK": "Недостаточно товара",
+}
+# Сколько раз перечитать корзину, если она меняется во время оформления
+CHECKOUT_ATTEMPTS = 3
+
 @app.post("/order")
-def create_order():
-    cart = r.hgetall("cart")
-    if not cart:
-        raise HTTPException(400, "Корзина пуста")
-    
-    total = 0
-    items = []
-    
-    for product_id, quantity in cart.items():
-        product_data = json.loads(r.hget("products", product_id))
-        qty = int(quantity)
-        
-        if product_data["stock"] < qty:
-            raise HTTPException(400, "Недостаточно товара")
-        
-        total += product_data["price"] * qty
-        items.append({"product_id": int(product_id), "quantity": qty})
-        
-        # Обновляем остаток
-        product_data["stock"] -= qty
-        r.hset("products", product_id, json.dumps(product_data))
-    
-    # Создаем заказ
-    order_id = r.incr("order_counter")
-    order = {"id": order_id, "items": items, "total": total}
-    r.hset("orders", str(order_id), json.dumps(order))
-    
-    # Очищаем корзину
-    r.delete("cart")
-    
-    return {"order_id": order_id, "total": total}
+async def create_order(
+    response: Response,
+    cart: str = Depends(cart_key),
+    session_id: str = Depends(get_session_id),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+):
+    for _ in range(CHECKOUT_ATTEMPTS):
+        product_ids = await r.hkeys(cart)
+        keys = [cart, "order_counter", "orders", "orders:ids", "versions"]
+        keys += [product_key(product_id) for product_id in product_ids]
+        if idempotency_key:
+            # Ключи разных покупателей не пересекаются
+            keys.append(f"idempotency:{session_id}:{idempotency_key}")
+        args = [IDEMPOTENCY_TTL, "1" if idempotency_key else "0", *product_ids]
+        try:
+            order, replayed = await checkout(keys=keys, args=args)
+            break
+        except redis.ResponseError as e:
+            if str(e) == "RETRY":
+                continue
+            if str(e) in CHECKOUT_ERRORS:
+                raise HTTPException(400, CHECKOUT_ERRORS[str(e)])
+            raise
+    else:
+        raise HTTPException(409, "Корзина изменяется, повторите заказ")
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    order = json.loads(order)
+    return {"order_id": order["id"], "total": order["total"]}
 
 @app.get("/orders")
-def get_orders():
-    orders = r.hgetall("orders")
-    return [json.loads(order) for order in orders.values()]
+async def get_orders(
+    limit: int = Query(100, ge=1, le=1000),
+    after: int = 0,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    names = parse_fields(fields, ORDER_FIELDS)
+    headers = await cache_headers("orders")
+    if response := not_modified(headers, if_none_match):
+        return response
+    ids = await page_ids("orders:ids", after, limit)
+    documents = await r.hmget("orders", ids) if ids else []
+    if len(names) < len(ORDER_FIELDS):
+        documents = [dumps({name: json.loads(d)[name] for name in names}) for d in documents]
+    # Без проекции заказы отдаются как есть, без json.loads/json.dumps
+    return page_response(ids, documents, limit, headers)
 
 @app.delete("/cart/{product_id}")
-def remove_from_cart(product_id: int):
-    r.hdel("cart", str(product_id))
+async def remove_from_cart(product_id: int, cart: str = Depends(cart_key)):
+    await r.hdel(cart, str(product_id))
     return {"ok": True}
\ No newline at end of file
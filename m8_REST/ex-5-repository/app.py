@@ -0,0 +1,154 @@
+"""Магазин с подключаемым хранилищем: один набор маршрутов для всех хранилищ.
+
+Хранилище выбирается переменной окружения SHOP_BACKEND:
+memory (по умолчанию), sqlalchemy или redis.
+"""
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Query, Depends, Header, Cookie, Response
+from pydantic import BaseModel
+from typing import List, Optional
+from uuid import uuid4
+import os
+
+from fast_response import FastJSONResponse
+from metrics import MetricsMiddleware, metrics_endpoint
+from repository import ShopRepository, ShopError, ProductNotFound
+
+# Настройки (переменные окружения)
+BACKEND = os.getenv("SHOP_BACKEND", "memory")
+DB_URL = os.getenv("SHOP_DB_URL", "sqlite+aiosqlite:///shop.db")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+CART_TTL = int(os.getenv("SHOP_CART_TTL", "1800"))  # секунд бездействия до удаления корзины
+
+def make_repository(backend: str) -> ShopRepository:
+    """Реализации импортируются только при выборе: для memory не нужны ни SQLAlchemy, ни redis"""
+    if backend == "memory":
+        from memory_repository import MemoryRepository
+        return MemoryRepository(CART_TTL)
+    if backend == "sqlalchemy":
+        from sqlalchemy_repository import SQLAlchemyRepository
+        return SQLAlchemyRepository(DB_URL, CART_TTL)
+    if backend == "redis":
+        from redis_repository import RedisRepository
+        return RedisRepository(REDIS_URL, REDIS_POOL_SIZE, REDIS_POOL_TIMEOUT, CART_TTL)
+    raise ValueError(f"Неизвестное хранилище SHOP_BACKEND={backend!r}: memory, sqlalchemy или redis")
+
+repository = make_repository(BACKEND)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await repository.startup()
+    yield
+    await repository.close()
+
+app = FastAPI(title=f"Shop API ({BACKEND})", lifespan=lifespan)
+# Время, коды ответов и обращения к хранилищу по маршрутам - GET /metrics (формат Prometheus)
+# Обращения к хранилищу считаются в каждом запросе, в том числе нулевые
+METRIC_BACKENDS = {"memory": (), "sqlalchemy": ("sql",), "redis": ("redis",)}
+app.add_middleware(MetricsMiddleware, backends=METRIC_BACKENDS[BACKEND])
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+@app.exception_handler(ShopError)
+async def shop_error_handler(request: Request, exc: ShopError):
+    return FastJSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+
+def get_repository() -> ShopRepository:
+    return repository
+
+def get_session_id(
+    response: Response,
+    x_session_id: Optional[str] = Header(None),
+    session_id: Optional[str] = Cookie(None),
+):
+    """Идентификатор покупателя: заголовок X-Session-Id или cookie session_id.
+    Новому покупателю выдается cookie."""
+    if x_session_id or session_id:
+        return x_session_id or session_id
+    new_session_id = uuid4().hex
+    response.set_cookie("session_id", new_session_id, max_age=CART_TTL, httponly=True)
+    return new_session_id
+
+class CartItem(BaseModel):
+    product_id: int
+    quantity: int
+
+# Модели ответов - для документации (OpenAPI). Хранилища уже отдают данные
+# этой формы, поэтому списки не проверяются повторно, а сериализуются сразу
+class Product(BaseModel):
+    id: int
+    name: str
+    price: float
+    stock: int
+
+class Order(BaseModel):
+    id: int
+    items: List[CartItem]
+    total: float
+
+def page(items, limit: int):
+    """Страница списка без jsonable_encoder (см. fast_json.py).
+    Курсор следующей страницы - в заголовке X-Next-Cursor (передать как ?after=)"""
+    headers = {"X-Next-Cursor": str(items[-1]["id"])} if len(items) == limit else None
+    return FastJSONResponse(items, headers=headers)
+
+@app.get("/products", response_model=List[Product])
+async def get_products(
+    limit: int = Query(100, ge=1, le=1000),
+    after: int = 0,
+    repo: ShopRepository = Depends(get_repository),
+):
+    return page(await repo.list_products(after, limit), limit)
+
+@app.get("/products/{product_id}", response_model=Product)
+async def get_product(product_id: int, repo: ShopRepository = Depends(get_repository)):
+    product = await repo.get_product(product_id)
+    if not product:
+        raise ProductNotFound()
+    return product
+
+@app.post("/cart")
+async def add_to_cart(
+    item: CartItem,
+    session_id: str = Depends(get_session_id),
+    repo: ShopRepository = Depends(get_repository),
+):
+    await repo.add_to_cart(session_id, item.product_id, item.quantity)
+    return {"ok": True}
+
+@app.get("/cart")
+async def get_cart(session_id: str = Depends(get_session_id), repo: ShopRepository = Depends(get_repository)):
+    items = []
+    total = 0
+    for line in await repo.get_cart(session_id):
+        subtotal = line["price"] * line["quantity"]
+        items.append({"product": line["name"], "quantity": line["quantity"], "subtotal": subtotal})
+        total += subtotal
+    return {"items": items, "total": total}
+
+@app.delete("/cart/{product_id}")
+async def remove_from_cart(
+    product_id: int,
+    session_id: str = Depends(get_session_id),
+    repo: ShopRepository = Depends(get_repository),
+):
+    await repo.remove_from_cart(session_id, product_id)
+    return {"ok": True}
+
+@app.post("/order")
+async def create_order(session_id: str = Depends(get_session_id), repo: ShopRepository = Depends(get_repository)):
+    order = await repo.place_order(session_id)
+    return {"order_id": order["id"], "total": order["total"]}
+
+@app.get("/orders", response_model=List[Order])
+async def get_orders(
+    limit: int = Query(100, ge=1, le=1000),
+    after: int = 0,
+    repo: ShopRepository = Depends(get_repository),
+):
+    return page(await repo.list_orders(after, limit), limit)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=8000)
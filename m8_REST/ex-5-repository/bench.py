@@ -0,0 +1,63 @@
+"""Сериализация страниц /products и /orders: обычный путь FastAPI против FastJSONResponse.
+
+Запуск: python bench.py  (хранилище memory, данные генерируются в памяти)
+"""
+from typing import List
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from pydantic import TypeAdapter
+
+import fast_json
+import fast_response
+import app
+
+def seed(repo, products=20000, orders=20000):
+    """Каталог и заказы прямо в MemoryRepository, без HTTP"""
+    repo.products = {
+        i: {"id": i, "name": f"Товар {i}", "price": 100.0 + i, "stock": i % 50}
+        for i in range(1, products + 1)
+    }
+    repo.product_ids = sorted(repo.products)
+    repo.orders = {
+        i: {"id": i, "items": [{"product_id": i % products + 1, "quantity": 2}, {"product_id": 1, "quantity": 1}],
+            "total": 2 * (100.0 + i % products + 1) + 101.0}
+        for i in range(1, orders + 1)
+    }
+    repo.order_ids = sorted(repo.orders)
+
+def measure(fn, rounds=50):
+    fn()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1000
+
+def bench_serialization(limit=1000):
+    """Одна страница из limit элементов тремя способами:
+    - default: без response_model - jsonable_encoder + json.dumps (JSONResponse);
+    - response_model: проверка и сериализация pydantic;
+    - FastJSONResponse: готовые dict сразу в orjson (или json без orjson)."""
+    repo = app.repository
+    seed(repo)
+    client = TestClient(app.app)
+    print(f"orjson: {'да' if fast_json.orjson else 'нет, стандартный json'}, страница {limit} элементов")
+    print(f"{'список':<10}{'default, мс':>14}{'response_model':>16}{'FastJSON':>10}{'HTTP, мс':>10}")
+    for path, model, items in (
+        ("/products", List[app.Product], repo.products),
+        ("/orders", List[app.Order], repo.orders),
+    ):
+        page = [items[i] for i in range(1, limit + 1)]
+        adapter = TypeAdapter(model)
+        default = measure(lambda: JSONResponse(jsonable_encoder(page)).body)
+        validated = measure(lambda: adapter.dump_json(adapter.validate_python(page)))
+        fast = measure(lambda: fast_response.FastJSONResponse(page).body)
+        assert json.loads(fast_response.FastJSONResponse(page).body) == json.loads(JSONResponse(jsonable_encoder(page)).body)
+        http = measure(lambda: client.get(path, params={"limit": limit}), rounds=20)
+        print(f"{path:<10}{default:>14.2f}{validated:>16.2f}{fast:>10.2f}{http:>10.2f}")
+
+if __name__ == "__main__":
+    bench_serialization()
@@ -0,0 +1,18 @@
+"""Быстрый JSON: orjson, если установлен, иначе стандартный json.
+
+Исходник - m8_REST/shared/fast_json.py; в примерах лежат его копии. Править
+исходник и запускать python m8_REST/shared/sync.py (см. shared/README.md).
+Ответ FastAPI с этим кодированием - FastJSONResponse в fast_response.py.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(obj) -> str:
+    """Компактный JSON-текст, не-ASCII символы не экранируются"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
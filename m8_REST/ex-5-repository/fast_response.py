@@ -0,0 +1,20 @@
+"""Ответ FastAPI в JSON через orjson (без orjson - стандартный json).
+
+Исходник - m8_REST/shared/fast_response.py; в примерах лежат его копии.
+Править исходник и запускать python m8_REST/shared/sync.py (см. shared/README.md).
+
+FastJSONResponse подключается явно: маршрут сам возвращает
+FastJSONResponse(данные). Ответ-Response FastAPI отдает как есть, без
+jsonable_encoder, на котором уходит основное время сериализации больших
+списков. Поэтому данные должны быть уже готовы для JSON: dict со
+строковыми ключами, list, str, int, float, bool, None.
+"""
+from fastapi.responses import JSONResponse
+
+from fast_json import dumps, orjson
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return dumps(content).encode()
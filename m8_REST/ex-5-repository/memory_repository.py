@@ -0,0 +1,93 @@
+"""Хранилище в памяти процесса (как ex-2): данные теряются при перезапуске."""
+from bisect import bisect_right
+from collections import OrderedDict
+import time
+
+from repository import INITIAL_PRODUCTS, ProductNotFound, OutOfStock, EmptyCart
+
+class MemoryRepository:
+    """Методы не содержат await между чтением и записью, поэтому в одном
+    event loop каждый из них выполняется атомарно и блокировки не нужны"""
+
+    def __init__(self, cart_ttl: int):
+        self.cart_ttl = cart_ttl
+        self.products = {}
+        self.product_ids = []  # отсортированы - для пагинации бинарным поиском
+        # session_id -> (истекает_в, {product_id: quantity}); порядок - по последнему
+        # обращению, поэтому брошенные корзины удаляются с начала словаря
+        self.carts = OrderedDict()
+        self.orders = {}
+        self.order_ids = []  # id растут, список всегда отсортирован
+
+    async def startup(self):
+        if not self.products:
+            self.products = {product["id"]: dict(product) for product in INITIAL_PRODUCTS}
+            self.product_ids = sorted(self.products)
+
+    async def close(self):
+        pass
+
+    async def list_products(self, after, limit):
+        start = bisect_right(self.product_ids, after)
+        return [dict(self.products[i]) for i in self.product_ids[start:start + limit]]
+
+    async def get_product(self, product_id):
+        product = self.products.get(product_id)
+        return dict(product) if product else None
+
+    async def set_stock(self, product_id, stock):
+        self.products[product_id]["stock"] = stock
+
+    def cart(self, session_id):
+        """Корзина покупателя; каждое обращение продлевает ее жизнь"""
+        now = time.monotonic()
+        while self.carts:
+            oldest_session, (expires_at, _) = next(iter(self.carts.items()))
+            if expires_at > now:
+                break
+            del self.carts[oldest_session]
+        _, cart = self.carts.pop(session_id, (None, {}))
+        self.carts[session_id] = (now + self.cart_ttl, cart)
+        return cart
+
+    async def add_to_cart(self, session_id, product_id, quantity):
+        product = self.products.get(product_id)
+        if not product:
+            raise ProductNotFound()
+        if product["stock"] < quantity:
+            raise OutOfStock()
+        cart = self.cart(session_id)
+        cart[product_id] = cart.get(product_id, 0) + quantity
+
+    async def get_cart(self, session_id):
+        return [
+            {"product_id": product_id, "name": self.products[product_id]["name"],
+             "price": self.products[product_id]["price"], "quantity": quantity}
+            for product_id, quantity in self.cart(session_id).items()
+        ]
+
+    async def remove_from_cart(self, session_id, product_id):
+        self.cart(session_id).pop(product_id, None)
+
+    async def place_order(self, session_id):
+        cart = self.cart(session_id)
+        if not cart:
+            raise EmptyCart()
+        if any(self.products[product_id]["stock"] < quantity for product_id, quantity in cart.items()):
+            raise OutOfStock()
+
+        for product_id, quantity in cart.items():
+            self.products[product_id]["stock"] -= quantity
+        order = {
+            "id": len(self.order_ids) + 1,
+            "items": [{"product_id": product_id, "quantity": quantity} for product_id, quantity in cart.items()],
+            "total": sum(self.products[product_id]["price"] * quantity for product_id, quantity in cart.items()),
+        }
+        self.orders[order["id"]] = order
+        self.order_ids.append(order["id"])
+        cart.clear()
+        return order
+
+    async def list_orders(self, after, limit):
+        start = bisect_right(self.order_ids, after)
+        return [self.orders[i] for i in self.order_ids[start:start + limit]]
@@ -0,0 +1,165 @@
+"""Хранилище в Redis (как ex-4-redis): hash на товар, корзина с TTL, заказ - Lua-скрипт."""
+import json
+
+import redis
+import redis.asyncio
+
+from metrics import count_call
+from repository import INITIAL_PRODUCTS, ProductNotFound, OutOfStock, EmptyCart, CartChanged
+
+# Оформление заказа целиком на стороне Redis (как в ex-4-redis): скрипт
+# выполняется атомарно, поэтому два параллельных заказа не могут оба пройти
+# проверку остатка. Все ключи скрипта передаются в KEYS, включая ключи товаров
+# корзины (их заранее читает HKEYS); товар без переданного ключа - корзина
+# изменилась, скрипт ничего не меняет и отвечает RETRY.
+# KEYS: корзина, order_counter, orders, orders:ids, ключи товаров из ARGV
+# ARGV: id товаров корзины
+CHECKOUT_LUA = """
+local cart = redis.call('HGETALL', KEYS[1])
+if #cart == 0 then
+    return redis.error_reply('EMPTY')
+end
+
+local product_keys = {}
+for i = 1, #ARGV do
+    product_keys[ARGV[i]] = KEYS[4 + i]
+end
+
+local items = {}
+local total = 0
+for i = 1, #cart, 2 do
+    local product_id, qty = cart[i], tonumber(cart[i + 1])
+    local key = product_keys[product_id]
+    if not key then
+        return redis.error_reply('RETRY')
+    end
+    local product = redis.call('HMGET', key, 'price', 'stock')
+    if not product[2] or tonumber(product[2]) < qty then
+        return redis.error_reply('STOCK')
+    end
+    total = total + tonumber(product[1]) * qty
+    items[#items + 1] = {product_id = tonumber(product_id), quantity = qty, key = key}
+end
+
+for _, item in ipairs(items) do
+    redis.call('HINCRBY', item.key, 'stock', -item.quantity)
+    item.key = nil
+end
+local order_id = redis.call('INCR', KEYS[2])
+local order = cjson.encode({id = order_id, items = items, total = total})
+redis.call('HSET', KEYS[3], order_id, order)
+redis.call('ZADD', KEYS[4], order_id, order_id)
+redis.call('DEL', KEYS[1])
+return order
+"""
+
+CHECKOUT_ERRORS = {"EMPTY": EmptyCart, "STOCK": OutOfStock}
+# Сколько раз перечитать корзину, если она меняется во время оформления
+CHECKOUT_ATTEMPTS = 3
+
+class MeteredPool(redis.asyncio.BlockingConnectionPool):
+    """Соединение берется из пула на каждую команду, конвейер или вызов
+    скрипта, т.е. на каждый round-trip - их и считаем в метриках запроса"""
+    async def get_connection(self, *args, **kwargs):
+        count_call("redis")
+        return await super().get_connection(*args, **kwargs)
+
+def product_key(product_id):
+    return f"product:{product_id}"
+
+def cart_key(session_id):
+    return f"cart:{session_id}"
+
+def parse_product(product_id, data):
+    """Поля hash товара приходят строками - приводим типы"""
+    return {"id": int(product_id), "name": data["name"], "price": float(data["price"]), "stock": int(data["stock"])}
+
+def parse_order(document):
+    """cjson кодирует целую сумму без дробной части - приводим к float, как в других хранилищах"""
+    order = json.loads(document)
+    order["total"] = float(order["total"])
+    return order
+
+class RedisRepository:
+    def __init__(self, url: str, pool_size: int, pool_timeout: float, cart_ttl: int):
+        self.cart_ttl = cart_ttl
+        # Пул фиксированного размера: при исчерпании запрос ждет свободное соединение
+        self.pool = MeteredPool.from_url(
+            url, max_connections=pool_size, timeout=pool_timeout, decode_responses=True
+        )
+        self.r = redis.asyncio.Redis(connection_pool=self.pool)
+        self.checkout = self.r.register_script(CHECKOUT_LUA)
+
+    async def startup(self):
+        if await self.r.exists("products:ids"):
+            return
+        pipe = self.r.pipeline()
+        for product in INITIAL_PRODUCTS:
+            pipe.hset(product_key(product["id"]), mapping={k: v for k, v in product.items() if k != "id"})
+            pipe.zadd("products:ids", {product["id"]: product["id"]})
+        await pipe.execute()
+
+    async def close(self):
+        await self.r.aclose()
+        await self.pool.disconnect()
+
+    async def page_ids(self, index, after, limit):
+        """Keyset-пагинация: id > after из отсортированного множества"""
+        return await self.r.zrangebyscore(index, f"({after}", "+inf", start=0, num=limit)
+
+    async def list_products(self, after, limit):
+        ids = await self.page_ids("products:ids", after, limit)
+        pipe = self.r.pipeline(transaction=False)
+        for product_id in ids:
+            pipe.hgetall(product_key(product_id))
+        return [parse_product(product_id, data) for product_id, data in zip(ids, await pipe.execute())]
+
+    async def get_product(self, product_id):
+        data = await self.r.hgetall(product_key(product_id))
+        return parse_product(product_id, data) if data else None
+
+    async def set_stock(self, product_id, stock):
+        await self.r.hset(product_key(product_id), "stock", stock)
+
+    async def add_to_cart(self, session_id, product_id, quantity):
+        stock = await self.r.hget(product_key(product_id), "stock")
+        if stock is None:
+            raise ProductNotFound()
+        if int(stock) < quantity:
+            raise OutOfStock()
+        pipe = self.r.pipeline()
+        pipe.hincrby(cart_key(session_id), str(product_id), quantity)
+        pipe.expire(cart_key(session_id), self.cart_ttl)
+        await pipe.execute()
+
+    async def get_cart(self, session_id):
+        cart = await self.r.hgetall(cart_key(session_id))
+        pipe = self.r.pipeline(transaction=False)
+        for product_id in cart:
+            pipe.hmget(product_key(product_id), "name", "price")
+        return [
+            {"product_id": int(product_id), "name": name, "price": float(price), "quantity": int(quantity)}
+            for (product_id, quantity), (name, price) in zip(cart.items(), await pipe.execute())
+        ]
+
+    async def remove_from_cart(self, session_id, product_id):
+        await self.r.hdel(cart_key(session_id), str(product_id))
+
+    async def place_order(self, session_id):
+        cart = cart_key(session_id)
+        for _ in range(CHECKOUT_ATTEMPTS):
+            product_ids = await self.r.hkeys(cart)
+            keys = [cart, "order_counter", "orders", "orders:ids", *(product_key(product_id) for product_id in product_ids)]
+            try:
+                return parse_order(await self.checkout(keys=keys, args=product_ids))
+            except redis.ResponseError as e:
+                if str(e) == "RETRY":
+                    continue
+                if str(e) in CHECKOUT_ERRORS:
+                    raise CHECKOUT_ERRORS[str(e)]()
+                raise
+        raise CartChanged()
+
+    async def list_orders(self, after, limit):
+        ids = await self.page_ids("orders:ids", after, limit)
+        return [parse_order(order) for order in await self.r.hmget("orders", ids)] if ids else []
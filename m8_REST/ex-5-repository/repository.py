@@ -0,0 +1,72 @@
+"""Интерфейс хранилища магазина.
+
+Маршруты в app.py работают только через ShopRepository, поэтому хранилище
+меняется настройкой SHOP_BACKEND без изменения кода маршрутов.
+"""
+from typing import List, Optional, Protocol
+
+# Начальные данные всех хранилищ
+INITIAL_PRODUCTS = [
+    {"id": 1, "name": "Телефон", "price": 50000.0, "stock": 10},
+    {"id": 2, "name": "Ноутбук", "price": 80000.0, "stock": 5},
+    {"id": 3, "name": "Наушники", "price": 5000.0, "stock": 20},
+]
+
+class ShopError(Exception):
+    """Ошибка магазина; app.py отдает ее клиенту с кодом status_code"""
+    status_code = 400
+    detail = "Ошибка магазина"
+
+class ProductNotFound(ShopError):
+    status_code = 404
+    detail = "Товар не найден"
+
+class OutOfStock(ShopError):
+    detail = "Недостаточно товара"
+
+class EmptyCart(ShopError):
+    detail = "Корзина пуста"
+
+class CartChanged(ShopError):
+    status_code = 409
+    detail = "Корзина изменяется, повторите заказ"
+
+class ShopRepository(Protocol):
+    """Хранилище товаров, корзин и заказов.
+
+    Товар - {"id", "name", "price", "stock"}, заказ - {"id", "items", "total"},
+    где items - [{"product_id", "quantity"}]. Списки отдаются keyset-страницами:
+    элементы с id > after по возрастанию id, не больше limit.
+    """
+
+    async def startup(self) -> None:
+        """Схема и начальные данные; вызывается при старте приложения"""
+
+    async def close(self) -> None:
+        """Освободить соединения; вызывается при остановке приложения"""
+
+    async def list_products(self, after: int, limit: int) -> List[dict]:
+        ...
+
+    async def get_product(self, product_id: int) -> Optional[dict]:
+        ...
+
+    async def set_stock(self, product_id: int, stock: int) -> None:
+        ...
+
+    async def add_to_cart(self, session_id: str, product_id: int, quantity: int) -> None:
+        """ProductNotFound / OutOfStock, если товара нет или его меньше quantity"""
+
+    async def get_cart(self, session_id: str) -> List[dict]:
+        """Строки корзины: {"product_id", "name", "price", "quantity"}"""
+
+    async def remove_from_cart(self, session_id: str, product_id: int) -> None:
+        ...
+
+    async def place_order(self, session_id: str) -> dict:
+        """Атомарно списать остатки и создать заказ из корзины.
+        EmptyCart / OutOfStock (CartChanged - корзина менялась во время оформления)
+        - заказ не создан, остатки не изменены."""
+
+    async def list_orders(self, after: int, limit: int) -> List[dict]:
+        ...
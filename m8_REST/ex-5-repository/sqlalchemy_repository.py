@@ -0,0 +1,165 @@
+"""Хранилище на SQLAlchemy (async), по умолчанию - SQLite через aiosqlite (как ex-3-sqlite)."""
+from datetime import datetime, timedelta
+import json
+
+from sqlalchemy import event, Index, Column, Integer, String, Float, Text, DateTime, ForeignKey, select, insert, update, delete
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
+
+from metrics import count_call
+from repository import INITIAL_PRODUCTS, ProductNotFound, OutOfStock, EmptyCart
+
+Base = declarative_base()
+
+class ProductDB(Base):
+    __tablename__ = "products"
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    price = Column(Float)
+    stock = Column(Integer)
+
+class CartDB(Base):
+    __tablename__ = "cart"
+    id = Column(Integer, primary_key=True)
+    session_id = Column(String)
+    product_id = Column(Integer, ForeignKey("products.id"))
+    quantity = Column(Integer)
+    updated_at = Column(DateTime, index=True)
+    __table_args__ = (Index("ix_cart_session_product", "session_id", "product_id"),)
+
+class OrderDB(Base):
+    __tablename__ = "orders"
+    id = Column(Integer, primary_key=True)
+    items = Column(Text)  # строки заказа в JSON
+    total = Column(Float)
+
+def product_dict(product: ProductDB):
+    return {"id": product.id, "name": product.name, "price": product.price, "stock": product.stock}
+
+# Для SQLite: WAL (чтение не ждет записи) и ожидание блокировки вместо ошибки
+SQLITE_PRAGMAS = {"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 5000}
+
+class SQLAlchemyRepository:
+    def __init__(self, url: str, cart_ttl: int):
+        self.cart_ttl = cart_ttl
+        self.engine = create_async_engine(url)
+        if url.startswith("sqlite"):
+            @event.listens_for(self.engine.sync_engine, "connect")
+            def set_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for name, value in SQLITE_PRAGMAS.items():
+                    cursor.execute(f"PRAGMA {name}={value}")
+                cursor.close()
+
+        # Каждый SQL-запрос - в метрики текущего HTTP-запроса
+        @event.listens_for(self.engine.sync_engine, "before_cursor_execute")
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            count_call("sql")
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def startup(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with self.sessions() as db:
+            if not await db.scalar(select(ProductDB.id).limit(1)):
+                db.add_all([ProductDB(**product) for product in INITIAL_PRODUCTS])
+                await db.commit()
+
+    async def close(self):
+        await self.engine.dispose()
+
+    def cart_of(self, session_id):
+        """Условия отбора строк корзины покупателя, которая еще не истекла"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.cart_ttl)
+        return (CartDB.session_id == session_id, CartDB.updated_at >= cutoff)
+
+    async def list_products(self, after, limit):
+        async with self.sessions() as db:
+            products = await db.scalars(select(ProductDB).where(ProductDB.id > after).order_by(ProductDB.id).limit(limit))
+            return [product_dict(product) for product in products]
+
+    async def get_product(self, product_id):
+        async with self.sessions() as db:
+            product = await db.get(ProductDB, product_id)
+            return product_dict(product) if product else None
+
+    async def set_stock(self, product_id, stock):
+        async with self.sessions() as db:
+            await db.execute(update(ProductDB).where(ProductDB.id == product_id).values(stock=stock))
+            await db.commit()
+
+    async def add_to_cart(self, session_id, product_id, quantity):
+        async with self.sessions() as db:
+            stock = await db.scalar(select(ProductDB.stock).where(ProductDB.id == product_id))
+            if stock is None:
+                raise ProductNotFound()
+            if stock < quantity:
+                raise OutOfStock()
+
+            now = datetime.utcnow()
+            await db.execute(delete(CartDB).where(CartDB.updated_at < now - timedelta(seconds=self.cart_ttl)))
+            # Увеличиваем количество одним UPDATE, без чтения строки корзины
+            result = await db.execute(
+                update(CartDB)
+                .where(CartDB.session_id == session_id, CartDB.product_id == product_id)
+                .values(quantity=CartDB.quantity + quantity)
+            )
+            if not result.rowcount:
+                db.add(CartDB(session_id=session_id, product_id=product_id, quantity=quantity))
+            # Продлеваем жизнь всей корзины
+            await db.flush()
+            await db.execute(update(CartDB).where(CartDB.session_id == session_id).values(updated_at=now))
+            await db.commit()
+
+    async def get_cart(self, session_id):
+        async with self.sessions() as db:
+            rows = await db.execute(
+                select(CartDB.product_id, ProductDB.name, ProductDB.price, CartDB.quantity)
+                .join(ProductDB, ProductDB.id == CartDB.product_id)
+                .where(*self.cart_of(session_id))
+            )
+            return [dict(row._mapping) for row in rows]
+
+    async def remove_from_cart(self, session_id, product_id):
+        async with self.sessions() as db:
+            await db.execute(delete(CartDB).where(CartDB.session_id == session_id, CartDB.product_id == product_id))
+            await db.commit()
+
+    def reserve_stock(self, cart):
+        """Атомарное списание всей корзины одним UPDATE: остаток проверяется
+        в WHERE, поэтому параллельные заказы не уводят его в минус"""
+        quantity = select(CartDB.quantity).where(CartDB.product_id == ProductDB.id, *cart).scalar_subquery()
+        return (
+            update(ProductDB)
+            .where(ProductDB.id.in_(select(CartDB.product_id).where(*cart)), ProductDB.stock >= quantity)
+            .values(stock=ProductDB.stock - quantity)
+            .execution_options(synchronize_session=False)
+        )
+
+    async def place_order(self, session_id):
+        cart = self.cart_of(session_id)
+        async with self.sessions() as db:
+            updated = (await db.execute(self.reserve_stock(cart))).rowcount
+
+            # Корзину читаем уже внутри транзакции записи - она не изменится до commit
+            lines = (await db.execute(
+                select(CartDB.product_id, CartDB.quantity, ProductDB.price)
+                .join(ProductDB, ProductDB.id == CartDB.product_id)
+                .where(*cart)
+            )).all()
+            if not lines:
+                raise EmptyCart()
+            if updated != len(lines):
+                raise OutOfStock()
+
+            items = [{"product_id": product_id, "quantity": quantity} for product_id, quantity, _ in lines]
+            total = sum(price * quantity for _, quantity, price in lines)
+            order_id = (await db.execute(insert(OrderDB).values(items=json.dumps(items), total=total))).inserted_primary_key[0]
+            await db.execute(delete(CartDB).where(CartDB.session_id == session_id))
+            await db.commit()
+            return {"id": order_id, "items": items, "total": total}
+
+    async def list_orders(self, after, limit):
+        async with self.sessions() as db:
+            orders = await db.scalars(select(OrderDB).where(OrderDB.id > after).order_by(OrderDB.id).limit(limit))
+            return [{"id": order.id, "items": json.loads(order.items), "total": order.total} for order in orders]
@@ -0,0 +1,206 @@
+"""Нагрузочный тест REST-магазинов m8_REST: один сценарий для всех хранилищ.
+
+Сценарий покупателя: каталог -> товар -> в корзину -> корзина -> заказ.
+Приложение запускается в этом же процессе и вызывается через ASGI-транспорт
+httpx (без сети) или, с --url, по HTTP у уже запущенного uvicorn.
+
+Запуск:
+    python loadtest.py                          # все хранилища по очереди
+    python loadtest.py --backend sqlite --users 50
+    python loadtest.py --backend memory --url http://127.0.0.1:8000
+
+Результаты (запросы/с и перцентили задержки по каждому endpoint) печатаются
+таблицей и сохраняются в JSON (--output, по умолчанию results.json).
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+import httpx
+
+REST_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PRODUCT_IDS = (1, 2, 3)  # товары из начальных данных всех магазинов
+STOCK = 10**9  # остаток перед тестом, чтобы заказы не упирались в него
+
+def restock_memory(shop):
+    for product in shop.products:
+        product.stock = STOCK
+
+def restock_sqlite(shop):
+    shop = sys.modules["shop"]  # shop_async использует модели и кэш из shop
+    with shop.SessionLocal() as db:
+        db.query(shop.ProductDB).update({"stock": STOCK})
+        db.commit()
+    shop.invalidate_catalog(PRODUCT_IDS)
+
+async def restock_redis(shop):
+    pipe = shop.r.pipeline()
+    for product_id in await shop.r.zrange("products:ids", 0, -1):
+        pipe.hset(shop.product_key(product_id), "stock", STOCK)
+    await pipe.execute()
+
+async def restock_repository(app):
+    for product_id in PRODUCT_IDS:
+        await app.repository.set_stock(product_id, STOCK)
+
+# Хранилище -> (каталог примера, модуль с app, пополнение остатков, переменные окружения).
+# {db} в переменных окружения заменяется путем к временной БД
+BACKENDS = {
+    "memory": ("ex-2", "shop", restock_memory, {}),
+    "sqlite": ("ex-3-sqlite", "shop", restock_sqlite, {"SHOP_DB_URL": "sqlite:///{db}"}),
+    "sqlite-async": ("ex-3-sqlite", "shop_async", restock_sqlite, {"SHOP_DB_URL": "sqlite:///{db}"}),
+    "redis": ("ex-4-redis", "shop", restock_redis, {}),
+    # Один app с подключаемым хранилищем (ex-5-repository)
+    "repo-memory": ("ex-5-repository", "app", restock_repository, {"SHOP_BACKEND": "memory"}),
+    "repo-sqlalchemy": ("ex-5-repository", "app", restock_repository,
+                        {"SHOP_BACKEND": "sqlalchemy", "SHOP_DB_URL": "sqlite+aiosqlite:///{db}"}),
+    "repo-redis": ("ex-5-repository", "app", restock_repository, {"SHOP_BACKEND": "redis"}),
+}
+
+def use_fakeredis_if_needed():
+    """Без локального Redis пул соединений магазина подключается к fakeredis"""
+    import redis
+    import redis.asyncio
+    try:
+        redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379")).ping()
+        print("ВНИМАНИЕ: тест перезаписывает остатки и заказы в локальном Redis", file=sys.stderr)
+        return
+    except redis.ConnectionError:
+        pass
+    import fakeredis
+    from fakeredis.aioredis import FakeConnection
+    server = fakeredis.FakeServer()
+
+    class FakeBlockingConnectionPool(redis.asyncio.BlockingConnectionPool):
+        @classmethod
+        def from_url(cls, url, **kwargs):
+            return cls(connection_class=FakeConnection, server=server, **kwargs)
+
+    redis.asyncio.BlockingConnectionPool = FakeBlockingConnectionPool
+    print("Локальный Redis недоступен - используется fakeredis", file=sys.stderr)
+
+def load_backend(name):
+    """Импорт приложения; SQL-хранилища работают с временной БД"""
+    directory, module, restock, env = BACKENDS[name]
+    sys.path.insert(0, os.path.join(REST_DIR, directory))
+    db = f"{tempfile.mkdtemp()}/loadtest.db"
+    for key, value in env.items():
+        os.environ.setdefault(key, value.format(db=db))
+    if "redis" in name:
+        use_fakeredis_if_needed()
+    return importlib.import_module(module), restock
+
+async def call(http, stats, name, method, url, **kwargs):
+    start = time.perf_counter()
+    response = await http.request(method, url, **kwargs)
+    elapsed = time.perf_counter() - start
+    endpoint = stats.setdefault(name, {"latencies": [], "errors": 0})
+    endpoint["latencies"].append(elapsed)
+    if response.status_code >= 400:
+        endpoint["errors"] += 1
+
+async def shopper(http, stats, rng, iterations):
+    """Один покупатель со своей корзиной проходит сценарий iterations раз"""
+    headers = {"X-Session-Id": uuid4().hex}
+    for _ in range(iterations):
+        product_id = rng.choice(PRODUCT_IDS)
+        await call(http, stats, "GET /products", "GET", "/products", headers=headers)
+        await call(http, stats, "GET /products/{id}", "GET", f"/products/{product_id}", headers=headers)
+        await call(http, stats, "POST /cart", "POST", "/cart", json={"product_id": product_id, "quantity": 1}, headers=headers)
+        await call(http, stats, "GET /cart", "GET", "/cart", headers=headers)
+        await call(http, stats, "POST /order", "POST", "/order", headers=headers)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def summarize(stats, elapsed):
+    endpoints = {}
+    for name, endpoint in stats.items():
+        latencies = endpoint["latencies"]
+        endpoints[name] = {
+            "requests": len(latencies),
+            "errors": endpoint["errors"],
+            "rps": round(len(latencies) / elapsed, 1),
+            **{f"p{p}_ms": round(percentile(latencies, p) * 1000, 2) for p in (50, 90, 99)},
+            "max_ms": round(max(latencies) * 1000, 2),
+        }
+    total = sum(endpoint["requests"] for endpoint in endpoints.values())
+    return {"elapsed_s": round(elapsed, 3), "requests": total, "rps": round(total / elapsed, 1), "endpoints": endpoints}
+
+async def run_scenario(http, users, iterations, seed):
+    stats = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(shopper(http, stats, random.Random(seed + i), iterations) for i in range(users)))
+    return summarize(stats, time.perf_counter() - start)
+
+async def run_backend(name, args):
+    if args.url:
+        # Сервер запущен отдельно: остатки пополнить нельзя, часть заказов может получить 400
+        async with httpx.AsyncClient(base_url=args.url, timeout=60) as http:
+            return await run_scenario(http, args.users, args.iterations, args.seed)
+
+    shop, restock = load_backend(name)
+    # ASGI-транспорт не запускает lifespan сам (Redis-магазин создает в нем данные)
+    async with shop.app.router.lifespan_context(shop.app):
+        result = restock(shop)
+        if asyncio.iscoroutine(result):
+            await result
+        transport = httpx.ASGITransport(app=shop.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://shop", timeout=60) as http:
+            return await run_scenario(http, args.users, args.iterations, args.seed)
+
+def print_table(results):
+    print(f"{'Хранилище':15} | {'Endpoint':18} | {'запр/с':>8} | {'p50, мс':>8} | {'p90, мс':>8} | {'p99, мс':>8} | {'ошибок':>6}")
+    for backend, result in results.items():
+        for name, endpoint in result["endpoints"].items():
+            print(
+                f"{backend:15} | {name:18} | {endpoint['rps']:8.1f} | {endpoint['p50_ms']:8.2f} | "
+                f"{endpoint['p90_ms']:8.2f} | {endpoint['p99_ms']:8.2f} | {endpoint['errors']:6}"
+            )
+        print(f"{backend:15} | {'всего':18} | {result['rps']:8.1f} |")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--backend", choices=[*BACKENDS, "all"], default="all")
+    parser.add_argument("--users", type=int, default=20, help="одновременных покупателей")
+    parser.add_argument("--iterations", type=int, default=10, help="проходов сценария на покупателя")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="адрес запущенного сервера вместо ASGI-транспорта")
+    parser.add_argument("--output", default="results.json")
+    args = parser.parse_args()
+
+    config = {
+        "users": args.users,
+        "iterations": args.iterations,
+        "seed": args.seed,
+        "url": args.url,
+        "python": sys.version.split()[0],
+    }
+    if args.backend != "all":
+        results = {args.backend: asyncio.run(run_backend(args.backend, args))}
+    else:
+        # Каждое хранилище - в своем процессе: у всех примеров модуль называется shop
+        results = {}
+        for name in BACKENDS:
+            with tempfile.NamedTemporaryFile(suffix=".json") as output:
+                command = [sys.executable, __file__, "--backend", name, "--output", output.name,
+                           "--users", str(args.users), "--iterations", str(args.iterations), "--seed", str(args.seed)]
+                subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+                results.update(json.load(output)["results"])
+
+    with open(args.output, "w") as f:
+        json.dump({"config": config, "results": results}, f, ensure_ascii=False, indent=2)
+    print_table(results)
+
+if __name__ == "__main__":
+    main()
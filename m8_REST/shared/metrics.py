@@ -0,0 +1,160 @@
+"""Метрики HTTP-запросов в текстовом формате Prometheus (без prometheus_client).
+
+Исходник - m8_REST/shared/metrics.py; в примерах лежат его копии. Править
+исходник и запускать python m8_REST/shared/sync.py (см. shared/README.md).
+
+Подключение:
+    app.add_middleware(MetricsMiddleware, backends=("sql",))
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+MetricsMiddleware - ASGI-middleware без BaseHTTPMiddleware: не буферизует
+ответ и добавляет к запросу несколько микросекунд. Метрики считаются по
+шаблону маршрута (/products/{product_id}), а не по URL, поэтому число рядов
+не растет с числом товаров. Обращения к БД/Redis приложение отмечает вызовом
+count_call("sql" | "redis"); они относятся к текущему запросу через contextvars
+(в том числе из пула потоков синхронных обработчиков). backends - хранилища
+приложения: для них backend_calls_per_request наблюдается в каждом запросе,
+и запрос без обращений (например, ответ из кэша) попадает в корзину le="0".
+
+Метрики хранятся в памяти процесса: у каждого воркера uvicorn свои.
+"""
+from bisect import bisect_left
+from contextvars import ContextVar
+import time
+
+from starlette.responses import PlainTextResponse
+
+# Границы корзин гистограмм (как у prometheus_client по умолчанию)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CALLS_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя - +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+class Metrics:
+    """Счетчики обновляются только из event loop (в middleware), поэтому без блокировок"""
+
+    def __init__(self):
+        self.requests = {}     # (method, route, status) -> число запросов
+        self.latency = {}      # (method, route) -> Histogram секунд
+        self.calls = {}        # (method, route, backend) -> Histogram обращений за запрос
+        self.exceptions = {}   # (method, route, тип исключения) -> число
+        self.in_progress = 0
+
+    def record(self, method, route, status, duration, calls):
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency[(method, route)] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(duration)
+        for backend, count in calls.items():
+            histogram = self.calls.get((method, route, backend))
+            if histogram is None:
+                histogram = self.calls[(method, route, backend)] = Histogram(CALLS_BUCKETS)
+            histogram.observe(count)
+
+    def render(self):
+        lines = [
+            "# HELP http_requests_total Запросы по маршруту и коду ответа",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in self.requests.items():
+            lines.append(f"http_requests_total{{{labels(method=method, route=route, status=status)}}} {count}")
+        lines += [
+            "# HELP http_request_duration_seconds Время обработки запроса, включая отправку тела",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), histogram in self.latency.items():
+            lines.extend(histogram.lines("http_request_duration_seconds", labels(method=method, route=route)))
+        lines += [
+            "# HELP http_requests_in_progress Запросы, которые обрабатываются сейчас",
+            "# TYPE http_requests_in_progress gauge",
+            f"http_requests_in_progress {self.in_progress}",
+            "# HELP http_request_exceptions_total Необработанные исключения (ответ 500)",
+            "# TYPE http_request_exceptions_total counter",
+        ]
+        for (method, route, exception), count in self.exceptions.items():
+            lines.append(f"http_request_exceptions_total{{{labels(method=method, route=route, exception=exception)}}} {count}")
+        lines += [
+            "# HELP backend_calls_per_request Обращения к БД/Redis за один запрос",
+            "# TYPE backend_calls_per_request histogram",
+        ]
+        for (method, route, backend), histogram in self.calls.items():
+            lines.extend(histogram.lines("backend_calls_per_request", labels(method=method, route=route, backend=backend)))
+        return "\n".join(lines) + "\n"
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def labels(**values):
+    return ",".join(f'{name}="{escape(value)}"' for name, value in values.items())
+
+metrics = Metrics()
+
+# Обращения к БД/Redis текущего запроса: backend -> число
+current_calls: ContextVar = ContextVar("current_calls", default=None)
+
+def count_call(backend: str):
+    """Отметить обращение к хранилищу; вне запроса (например, при старте) не учитывается"""
+    calls = current_calls.get()
+    if calls is not None:
+        calls[backend] = calls.get(backend, 0) + 1
+
+class MetricsMiddleware:
+    def __init__(self, app, backends=()):
+        self.app = app
+        self.backends = tuple(backends)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        calls = dict.fromkeys(self.backends, 0)
+        token = current_calls.set(calls)
+        metrics.in_progress += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as exc:
+            key = (scope["method"], route_of(scope), type(exc).__name__)
+            metrics.exceptions[key] = metrics.exceptions.get(key, 0) + 1
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            metrics.in_progress -= 1
+            current_calls.reset(token)
+            metrics.record(scope["method"], route_of(scope), status, duration, calls)
+
+def route_of(scope):
+    """Шаблон маршрута; роутер дописывает его в scope при сопоставлении"""
+    route = scope.get("route")
+    return route.path if route is not None else "<unmatched>"
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
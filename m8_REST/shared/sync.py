@@ -0,0 +1,45 @@
+"""Копирует общие модули в примеры; --check только сравнивает копии с исходником.
+
+Запуск (из любой папки):
+    python m8_REST/shared/sync.py          # обновить копии
+    python m8_REST/shared/sync.py --check  # код 1, если какая-то копия отличается
+"""
+import os
+import sys
+
+SHARED_DIR = os.path.dirname(os.path.abspath(__file__))
+REST_DIR = os.path.dirname(SHARED_DIR)
+
+# Модуль -> папки примеров (относительно m8_REST), где лежат его копии
+COPIES = {
+    "fast_json.py": ["ex-3-sqlite", "ex-4-redis", "ex-5-repository", "../m11_Brockers/ex-4-kubernetes"],
+    "fast_response.py": ["ex-5-repository", "../m11_Brockers/ex-4-kubernetes"],
+    "metrics.py": ["ex-2", "ex-3-sqlite", "ex-4-redis", "ex-5-repository"],
+}
+
+def main(check: bool) -> int:
+    stale = []
+    for name, directories in COPIES.items():
+        with open(os.path.join(SHARED_DIR, name), "rb") as f:
+            source = f.read()
+        for directory in directories:
+            path = os.path.normpath(os.path.join(REST_DIR, directory, name))
+            try:
+                with open(path, "rb") as f:
+                    same = f.read() == source
+            except FileNotFoundError:
+                same = False
+            if same:
+                continue
+            stale.append(os.path.relpath(path, REST_DIR))
+            if not check:
+                with open(path, "wb") as f:
+                    f.write(source)
+    if check and stale:
+        print("Копии отличаются от m8_REST/shared:", *stale, sep="\n  ")
+        return 1
+    print(f"Обновлено копий: {len(stale)}" if not check else "Копии совпадают с m8_REST/shared")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main("--check" in sys.argv[1:]))